@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : pullmessages.py                             #
+#           Benchmark PullMessages reply parsing,       #
+#           fast parser vs zeep                         #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opt", "xvr"))
+import onvif
+from onvif.parsers import parse_notifications, notifications_from_zeep
+from onvif.settings import DEFAULT_SETTINGS
+from onvif.transport import ASYNC_TRANSPORT
+from zeep import Client
+from zeep.loader import parse_xml
+#########################################################
+
+####################### GLOBALS #########################
+REPLIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replies")
+WSDL = os.path.join(os.path.dirname(onvif.__file__), "wsdl", "events.wsdl")
+BINDING = "{http://www.onvif.org/ver10/events/wsdl}PullPointSubscriptionBinding"
+NUMBER = 2000
+#########################################################
+
+###################### FUNCTIONS ########################
+def zeepOperation():
+    client = Client(WSDL, transport=ASYNC_TRANSPORT, settings=DEFAULT_SETTINGS)
+    return client.wsdl.bindings[BINDING].get("PullMessages")
+
+def zeepParse(operation, content):
+    envelope = parse_xml(content, ASYNC_TRANSPORT, settings=DEFAULT_SETTINGS)
+    return notifications_from_zeep(operation.process_reply(envelope))
+
+def bench():
+    operation = zeepOperation()
+    print(f"{'reply':<30}{'zeep us':>10}{'fast us':>10}{'speedup':>10}")
+    for name in sorted(os.listdir(REPLIES)):
+        if not name.endswith(".xml"):
+            continue
+        with open(os.path.join(REPLIES, name), "rb") as f:
+            content = f.read()
+        fast = parse_notifications(content)
+        slow = zeepParse(operation, content)
+        if fast != slow:
+            print(f"{name}: fast parser result differs from zeep")
+        tzeep = timeit.timeit(lambda: zeepParse(operation, content), number=NUMBER) / NUMBER * 1e6
+        tfast = timeit.timeit(lambda: parse_notifications(content), number=NUMBER) / NUMBER * 1e6
+        print(f"{name:<30}{tzeep:>10.1f}{tfast:>10.1f}{tzeep / tfast:>9.1f}x")
+
+#########################################################
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : soaprequests.py                             #
+#           Benchmark building hot SOAP requests,       #
+#           zeep vs compiled requests                   #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import asyncio
+from datetime import timedelta
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opt", "xvr"))
+import onvif
+from onvif.client import ONVIFService
+from onvif.compiled import compile_request
+from lxml import etree
+from zeep.wsdl.utils import etree_to_string
+#########################################################
+
+####################### GLOBALS #########################
+WSDL = os.path.join(os.path.dirname(onvif.__file__), "wsdl", "events.wsdl")
+PULLPOINT = "{http://www.onvif.org/ver10/events/wsdl}PullPointSubscriptionBinding"
+SUBSCRIPTION = "{http://www.onvif.org/ver10/events/wsdl}SubscriptionManagerBinding"
+ADDRESS = "http://192.168.1.10:2020/onvif/pullpoint"
+REQUESTS = [
+    (PULLPOINT, "PullMessages", {"MessageLimit": 100, "Timeout": timedelta(seconds=30)}),
+    (PULLPOINT, "SetSynchronizationPoint", {}),
+    (SUBSCRIPTION, "Renew", {"TerminationTime": "PT60S"}),
+]
+VARIANT = ("MessageID", "Nonce", "Created", "Password")
+NUMBER = 5000
+#########################################################
+
+###################### FUNCTIONS ########################
+async def createService(binding):
+    service = ONVIFService(ADDRESS, "admin", "secret", WSDL, binding_name=binding, no_cache=True)
+    await service.setup()
+    return service
+
+def zeepRequest(service, name, params):
+    proxy = service.ws_client
+    envelope, _ = proxy._binding._create(name, (), dict(params), client=proxy._client, options=proxy._binding_options)
+    return etree_to_string(envelope)
+
+def normalize(content):
+    root = etree.fromstring(content)
+    for element in root.iter():
+        if isinstance(element.tag, str) and etree.QName(element).localname in VARIANT:
+            element.text = ""
+    return etree.tostring(root, method="c14n")
+
+def bench():
+    print(f"{'request':<28}{'zeep us':>10}{'compiled us':>14}{'speedup':>10}")
+    for binding, name, params in REQUESTS:
+        service = asyncio.run(createService(binding))
+        proxy = service.ws_client
+        envelope, headers = proxy._binding._create(name, (), dict(params), client=proxy._client, options=proxy._binding_options)
+        request = compile_request(envelope, headers, service.user, service.passwd, service.dt_diff)
+        if normalize(request.render()) != normalize(zeepRequest(service, name, params)):
+            print(f"{name}: compiled request differs from zeep")
+        tzeep = timeit.timeit(lambda: zeepRequest(service, name, params), number=NUMBER) / NUMBER * 1e6
+        tcompiled = timeit.timeit(request.render, number=NUMBER) / NUMBER * 1e6
+        print(f"{name:<28}{tzeep:>10.1f}{tcompiled:>14.1f}{tzeep / tcompiled:>9.1f}x")
+
+#########################################################
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : wsdlcache.py                                #
+#           Benchmark cold start WSDL loading,          #
+#           parsing vs on-disk document cache           #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import os
+import subprocess
+import sys
+import tempfile
+#########################################################
+
+####################### GLOBALS #########################
+XVR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opt", "xvr")
+WSDLS = ["devicemgmt.wsdl", "events.wsdl"]
+RUNS = 5
+# runs in a new process to measure a cold start, prints the load time in ms
+LOADER = """
+import asyncio, os, sys, time
+sys.path.insert(0, {xvr!r})
+import onvif
+from onvif.client import _cached_document
+from onvif.doccache import set_cache_dir
+set_cache_dir({cache!r})
+async def load():
+    for name in {wsdls!r}:
+        await _cached_document(os.path.join(os.path.dirname(onvif.__file__), "wsdl", name))
+start = time.perf_counter()
+asyncio.run(load())
+print((time.perf_counter() - start) * 1000)
+"""
+#########################################################
+
+###################### FUNCTIONS ########################
+def coldStart(cache):
+    code = LOADER.format(xvr=XVR, cache=cache, wsdls=WSDLS)
+    return float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+
+def bench():
+    with tempfile.TemporaryDirectory() as cache:
+        parsed = min(coldStart(None) for _ in range(RUNS))
+        coldStart(cache) # fill cache
+        cached = min(coldStart(cache) for _ in range(RUNS))
+    print(f"{'documents':<34}{'parse ms':>10}{'cache ms':>10}{'speedup':>10}")
+    print(f"{', '.join(WSDLS):<34}{parsed:>10.1f}{cached:>10.1f}{parsed / cached:>9.1f}x")
+
+#########################################################
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : layout.py                                   #
+#           Folder layout of recordings, flat or        #
+#           partitioned on date                         #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import os
+import shutil
+from threading import Lock
+from datetime import datetime
+from common.common import common
+#########################################################
+
+####################### GLOBALS #########################
+FILENAMEFORMAT = "%Y%m%d-%H%M%S"
+FORMATLENGTH   = 15 # length of a formatted timestamp
+FLAT           = "flat"
+PARTITIONS     = {FLAT: "", "daily": os.path.join("%Y", "%m", "%d"), "hourly": os.path.join("%Y", "%m", "%d", "%H")}
+EXTENSIONS     = (".mp4", ".jpg") # recordings and snapshots
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : layout                                        #
+#########################################################
+class layout(object):
+    def __init__(self, general):
+        self.mode = str(common.getsetting(general, "layout", FLAT)).lower()
+        if self.mode not in PARTITIONS:
+            self.mode = FLAT
+        self.folderformat = PARTITIONS[self.mode]
+        self.prepared = set()
+        self.mutex = Lock() # shared by the recorder and cleanup, a pruned folder is prepared again
+
+    def partitioned(self):
+        return self.mode != FLAT
+
+    def folder(self, timestamp = 0): # partition for a time, relative to the camera folder
+        if not self.partitioned():
+            return ""
+        return (datetime.fromtimestamp(timestamp) if timestamp else datetime.now()).strftime(self.folderformat)
+
+    def filename(self, suffix, timestamp = 0): # 2024/12/09/20241209-155315.mp4
+        when = datetime.fromtimestamp(timestamp) if timestamp else datetime.now()
+        return os.path.join(self.folder(when.timestamp()), when.strftime(FILENAMEFORMAT) + suffix)
+
+    def pattern(self, suffix): # strftime pattern for the segment muxer
+        return os.path.join(self.folderformat, FILENAMEFORMAT + suffix)
+
+    def locate(self, name): # relative name of a file named after its time, e.g. from the segment list
+        name = os.path.basename(name)
+        if self.partitioned():
+            try:
+                return os.path.join(self.folder(datetime.strptime(name[:FORMATLENGTH], FILENAMEFORMAT).timestamp()), name)
+            except ValueError:
+                pass
+        return name
+
+    def prepare(self, path, *timestamps): # create partition folders before they are written
+        for timestamp in timestamps:
+            folder = self.folder(timestamp)
+            if folder:
+                with self.mutex:
+                    if not folder in self.prepared:
+                        os.makedirs(os.path.join(path, folder), exist_ok = True)
+                        self.prepared.add(folder)
+
+    def expired(self, path, before): # whole partitions ending before a timestamp, oldest first
+        folders = []
+        if self.partitioned():
+            depth = self.folderformat.count(os.sep) + 1
+            self.collect(path, "", depth, folders)
+            folders.sort()
+            folders = [folder for folder in folders if self.end(folder) <= before]
+        return folders
+
+    def collect(self, path, folder, depth, folders):
+        if depth == 0:
+            folders.append(folder)
+            return
+        try:
+            with os.scandir(os.path.join(path, folder)) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name.isdigit():
+                        self.collect(path, os.path.join(folder, entry.name), depth - 1, folders)
+        except FileNotFoundError:
+            pass
+
+    def end(self, folder): # timestamp at the end of a partition
+        try:
+            start = datetime.strptime(folder, self.folderformat)
+        except ValueError:
+            return float("inf")
+        if self.mode == "hourly":
+            return start.timestamp() + 3600
+        return start.timestamp() + 86400
+
+    def removeFolder(self, path, folder): # remove a partition and its parents when empty
+        with self.mutex:
+            shutil.rmtree(os.path.join(path, folder), ignore_errors = True)
+            self.prepared.discard(folder)
+        self.prune(path, os.path.dirname(folder))
+
+    def prune(self, path, folder): # remove empty partition folders up to the camera folder
+        while folder:
+            with self.mutex:
+                try:
+                    os.rmdir(os.path.join(path, folder))
+                except OSError:
+                    break
+                self.prepared.discard(folder)
+            folder = os.path.dirname(folder)
+
+    def migrate(self, path): # move files of a flat folder into partitions, returns old to new names
+        moved = {}
+        if self.partitioned() and os.path.isdir(path):
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file() and os.path.splitext(entry.name)[1] in EXTENSIONS:
+                        try:
+                            timestamp = datetime.strptime(entry.name[:FORMATLENGTH], FILENAMEFORMAT).timestamp()
+                        except ValueError:
+                            timestamp = entry.stat().st_mtime
+                        name = os.path.join(self.folder(timestamp), entry.name)
+                        os.makedirs(os.path.join(path, os.path.dirname(name)), exist_ok = True)
+                        os.replace(entry.path, os.path.join(path, name))
+                        moved[entry.name] = name
+        return moved
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : reconnect.py                                #
+#           Reconnect policy, exponential backoff       #
+#           with jitter and circuit breaker             #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import random
+import time
+from common.common import common
+#########################################################
+
+####################### GLOBALS #########################
+RETRY_MIN    = 1   # s, first retry delay
+RETRY_MAX    = 60  # s, maximum retry delay
+RETRY_BREAK  = 10  # failures in a row before the circuit opens
+RETRY_PAUSE  = 300 # s, time the circuit stays open before probing
+RETRY_STABLE = 60  # s, connected time after which failures are forgotten
+JITTER       = 0.5 # part of the delay that is randomized
+
+OK       = "ok"       # connected
+BACKOFF  = "backoff"  # retrying with increasing delay
+OPEN     = "open"     # too many failures, no retries until pause passed
+HALFOPEN = "halfopen" # single probe after pause
+
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : reconnect                                     #
+#########################################################
+class reconnect(object):
+    def __init__(self, general, callback = None):
+        self.mindelay = common.getsetting(general, "retrymin", RETRY_MIN)
+        self.maxdelay = common.getsetting(general, "retrymax", RETRY_MAX)
+        self.threshold = common.getsetting(general, "retrybreak", RETRY_BREAK)
+        self.pause = common.getsetting(general, "retrypause", RETRY_PAUSE)
+        self.callback = callback
+        self.state = OK
+        self.failures = 0
+        self.connected = None
+
+    def __repr__(self):
+        return self.state
+
+    def attempt(self): # call right before connecting
+        if self.state == OPEN:
+            self.setState(HALFOPEN)
+
+    def success(self):
+        self.connected = time.monotonic()
+        self.setState(OK)
+
+    def failure(self): # returns the delay before the next attempt in s
+        now = time.monotonic()
+        if self.connected != None and now - self.connected >= RETRY_STABLE:
+            self.failures = 0 # only forget failures of connections that lasted, flapping keeps backing off
+        self.connected = None
+        self.failures += 1
+        if self.state == HALFOPEN or (self.threshold > 0 and self.failures >= self.threshold):
+            self.setState(OPEN)
+            delay = self.pause
+        else:
+            self.setState(BACKOFF)
+            delay = min(self.maxdelay, self.mindelay * 2 ** (self.failures - 1))
+        return self.jitter(delay)
+
+    def jitter(self, delay): # spread retries of cameras failing at the same time
+        return delay * (1 - JITTER * random.random())
+
+    def setState(self, state):
+        if state != self.state:
+            self.state = state
+            if self.callback:
+                self.callback(state)
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
@@ -8,18 +8,39 @@
 
 ####################### IMPORTS #########################
 import asyncio
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 import onvif
 import os.path
-from threading import Thread, Event
 import time
+from threading import Thread, Event, Lock
 from common.common import common
+from common.reconnect import reconnect, OPEN, HALFOPEN
+from interface.notify import notify
+from interface.rules import rules
+from onvif.devicecache import DeviceCache
+from onvif.doccache import get_cache_dir
+from onvif.exceptions import ONVIFTimeoutError
+import httpx
 #########################################################
 
 ####################### GLOBALS #########################
 SUBSCRIPTION_TIME = timedelta(minutes=1)
-WAIT_TIME = timedelta(seconds=1)
+MAX_CONNECTS = 8 # cameras connecting and subscribing at the same time
+PUSH_TIMEOUT = timedelta(minutes=1) # fall back to pullpoint if no notification within this time
+PULL_TIMEOUT = 30 # s, server side long-poll timeout
+PULL_MAXTIMEOUT = 60 # s, below the pullpoint read timeout of the onvif library
+PULL_LIMIT = 100 # messages per pull
+PULL_LATENCY = 1 # s, maximum added latency for cameras ignoring the pull timeout
+IGNORE_RATIO = 0.5 # an empty reply within this part of the timeout means the timeout is ignored
+STATS_INTERVAL = 60 # s
+SNAPSHOT_WORKERS = 2 # snapshots downloaded at the same time
+SNAPSHOT_QUEUE = 32 # pending snapshots, more are dropped
+SNAPSHOT_TIMEOUT = 10 # s
+SHUTDOWN_TIMEOUT = 3 # s, to unsubscribe when stopping, within the time the hub waits for all detectors
+STOP_TIMEOUT = 5 # s, time the hub waits for all detectors to shut down
+DEVICE_CACHE = 24 # h, time to keep device capabilities and addresses
+RECONNECT_ERRORS = (httpx.TransportError, asyncio.TimeoutError, ONVIFTimeoutError) # camera not reachable
 
 #########################################################
 
@@ -30,54 +51,45 @@ WAIT_TIME = timedelta(seconds=1)
 #########################################################
 # Class : detector                                      #
 #########################################################
-class detector(Thread):
-    def __init__(self, basename, camname, settings, callback = None, loglevel = logging.CRITICAL):
+class detector(object):
+    def __init__(self, basename, camname, settings, general, callback = None, cbStats = None, cbState = None):
         self.logger = logging.getLogger('{}.detector [{}]'.format(basename, camname))
-        self.detect = {"motion": False, "pet": False, "vehicle": False, "person": False}
+        self.camname = camname
         self.settings = settings
+        self.rules = rules(basename, camname, settings)
+        self.detect = {topictype: False for topictype in self.rules.types}
         self.callback = callback
-        logging.getLogger("zeep").setLevel(loglevel)
-        logging.getLogger("httpx").setLevel(loglevel)
         self.term = Event()
         self.term.clear()
         self.retries = 0
-        Thread.__init__(self)
-        
+        self.retry = reconnect(general, cbState)
+        self.push = common.getsetting(self.settings, "onvifpush", False)
+        self.queue = None
+        self.camera = None
+        self.profile = common.getsetting(self.settings, "snapshotprofile")
+        self.cbStats = cbStats
+        self.stats = {}
+        self.clearStats()
+
     def __del__(self):
+        del self.retry
+        del self.rules
+        del self.stats
         del self.term
         del self.logger
 
     def subscription_lost(self):
         self.logger.info("subscription lost")
         self.retries += 1
+        if self.queue:
+            try:
+                self.queue.put_nowait(None) # wake push loop
+            except asyncio.QueueFull:
+                pass
         
-    def parseTopicMessage(self, nm):
-        tp = nm["Topic"]["_value_1"].split(":")
-        if len(tp) > 1:
-            ns = tp[0]
-            topic = tp[1]
-        else:
-            topic = tp[0]
-            ns = ""
-        mes = nm["Message"]["_value_1"]
-        return topic, mes, ns
-        
-    def getTopicType(self, topic):
-        topictype = None
-        if topic == "RuleEngine/CellMotionDetector/Motion" or topic == "RuleEngine/MotionRegionDetector/Motion":
-            topictype = "motion"
-        elif topic == "RuleEngine/MyRuleDetector/DogCatDetect":
-            topictype = "pet"
-        elif topic == "RuleEngine/MyRuleDetector/VehicleDetect":
-            topictype = "vehicle"
-        elif topic == "RuleEngine/MyRuleDetector/PeopleDetect" or topic == "RuleEngine/TPSmartEventDetector/TPSmartEvent" or topic == "RuleEngine/PeopleDetector/People":
-            topictype = "person"
-        return topictype
-        
-    def checkvalue(self, topictype, mes):
+    def checkvalue(self, topictype, value):
         changed = False
         if topictype:
-            value = mes.Data.SimpleItem[0].Value == "true"
             if self.detect[topictype] != value:
                 changed = True
                 self.detect[topictype] = value
@@ -85,17 +97,49 @@ class detector(Thread):
     
         
     def parse(self, messages):
-        if 'NotificationMessage' in messages:
-            for nm in messages['NotificationMessage']:
-                topic, mes, ns = self.parseTopicMessage(nm)
-                topictype = self.getTopicType(topic)
-                if self.checkvalue(topictype, mes):
+        count = 0
+        if messages:
+            for mes in messages.messages: # compact notification records (onvif.parsers)
+                count += 1
+                self.addLatency(mes)
+                topictype, value = self.rules.match(mes)
+                if self.checkvalue(topictype, value):
                     if self.callback:
                         types = common.getsetting(self.settings, "onviftype", [])
                         if topictype in types:
                             self.callback(topictype, self.detect[topictype])
                     self.logger.debug(f"{topictype}: {self.detect[topictype]}")
-        
+        return count
+
+    def addLatency(self, mes):
+        try:
+            latency = (datetime.now(timezone.utc) - mes.utc_time).total_seconds()
+            self.latency.append(max(latency, 0))
+        except:
+            pass
+
+    def clearStats(self):
+        self.statsStart = time.monotonic()
+        self.requests = 0
+        self.events = 0
+        self.latency = []
+
+    def updateStats(self, mode, timeout = 0, delay = 0, ignores = False):
+        elapsed = time.monotonic() - self.statsStart
+        if elapsed >= STATS_INTERVAL:
+            self.stats = {
+                "mode": mode,
+                "requests_min": round(self.requests * 60 / elapsed, 1),
+                "events_min": round(self.events * 60 / elapsed, 1),
+                "event_latency_ms": round(sum(self.latency) * 1000 / len(self.latency)) if self.latency else 0,
+                "timeout_s": timeout,
+                "ignores_timeout": ignores,
+                "poll_delay_s": round(delay, 3)
+            }
+            self.clearStats()
+            if self.cbStats:
+                self.cbStats(dict(self.stats))
+
     """
     tns1:RuleEngine/CellMotionDetector/Motion
     tns1:RuleEngine/MotionRegionDetector/Motion
@@ -103,6 +147,9 @@ class detector(Thread):
     tns1:RuleEngine/MyRuleDetector/VehicleDetect
     tns1:RuleEngine/PeopleDetector/People or tns1:RuleEngine/TPSmartEventDetector/TPSmartEvent
         or tns1:RuleEngine/MyRuleDetector/PeopleDetect
+    zeep reply, read into a compact record by onvif.parsers:
+    NotificationRecord(topic='tns1:RuleEngine/CellMotionDetector/Motion', utc_time=..., property_operation='Changed',
+                       source={'VideoSourceConfigurationToken': 'vsconf', ...}, data={'IsMotion': 'true'})
     {
         'CurrentTime': datetime.datetime(2024, 12, 7, 8, 57, 21, tzinfo=datetime.timezone.utc),
         'TerminationTime': datetime.datetime(2024, 12, 7, 8, 58, 7, tzinfo=datetime.timezone.utc),
@@ -172,64 +219,290 @@ class detector(Thread):
 
     """
 
-    async def events(self):
-        try:
-            mycam = onvif.ONVIFCamera(common.getsetting(self.settings, "host"), 
-                                      common.getsetting(self.settings, "onvifport", 2020), 
-                                      common.getsetting(self.settings, "username"), 
-                                      common.getsetting(self.settings, "password"), 
-                                      wsdl_dir=f"{os.path.dirname(onvif.__file__)}/wsdl/")
-            await mycam.update_xaddrs()
-        except:
-            self.retries += 1
-            if self.retries == 1:
-                self.logger.error("Cannot connect to camera")
-            return
+    async def events(self, connect, listener, devices):
+        push = self.push and listener != None and listener.running()
+        async with connect: # limit cameras connecting at the same time
+            mycam = None
+            restored = False
+            try:
+                mycam = onvif.ONVIFCamera(common.getsetting(self.settings, "host"), 
+                                          common.getsetting(self.settings, "onvifport", 2020), 
+                                          common.getsetting(self.settings, "username"), 
+                                          common.getsetting(self.settings, "password"), 
+                                          wsdl_dir=f"{os.path.dirname(onvif.__file__)}/wsdl/",
+                                          device_cache=devices)
+                restored = mycam.restore_xaddrs() # skip the handshake on reconnect
+                if not restored:
+                    await mycam.update_xaddrs()
+            except:
+                self.retries += 1
+                if self.retries == 1:
+                    self.logger.error("Cannot connect to camera")
+                await self.close(mycam)
+                return
         
-        try:
-            manager = await mycam.create_pullpoint_manager(SUBSCRIPTION_TIME, self.subscription_lost)
-            await manager.set_synchronization_point()
+            try:
+                if push:
+                    self.queue = await listener.subscribe(self.camname, common.getsetting(self.settings, "host"))
+                    manager = await mycam.create_notification_manager(listener.address(self.camname), SUBSCRIPTION_TIME, self.subscription_lost)
+                else:
+                    manager = await mycam.create_pullpoint_manager(SUBSCRIPTION_TIME, self.subscription_lost)
+                await manager.set_synchronization_point()
         
-            pullpoint = manager.get_service()
-        except:
-            self.retries += 1
-            if self.retries == 1:
-                self.logger.error("Cannot create pullpoint")
-            return
-            
-        self.logger.info("listening")
+                pullpoint = manager.get_service()
+            except Exception as e:
+                if restored and not isinstance(e, RECONNECT_ERRORS): # camera answered, but cached info may be outdated
+                    mycam.invalidate_xaddrs()
+                self.retries += 1
+                if self.retries == 1:
+                    self.logger.error("Cannot create {}".format("notification subscription" if push else "pullpoint"))
+                if push:
+                    self.unsubscribe(listener)
+                await self.close(mycam)
+                return
+
+        self.logger.info("listening{}".format(" for notifications" if push else ""))
         self.retries = 0
+        self.retry.success()
+        self.camera = mycam
+        try:
+            if push:
+                await self.notifications(manager)
+            else:
+                await self.pull(pullpoint)
+        finally: # also when cancelled by the hub, so the subscription is removed instead of left to expire
+            self.camera = None
+            if push:
+                self.unsubscribe(listener)
+            self.logger.info("shutdown")
+            try:
+                await asyncio.wait_for(manager.shutdown(), SHUTDOWN_TIMEOUT)
+            except:
+                pass
+            await self.close(mycam)
+
+    async def close(self, mycam):
+        if mycam:
+            try:
+                await mycam.close()
+            except:
+                pass
+
+    async def pull(self, pullpoint):
+        # long-poll, cameras returning empty replies early ignore the timeout and are polled with a delay
+        timeout = min(common.getsetting(self.settings, "pulltimeout", PULL_TIMEOUT), PULL_MAXTIMEOUT)
+        limit = common.getsetting(self.settings, "pulllimit", PULL_LIMIT)
+        latency = common.getsetting(self.settings, "pulllatency", PULL_LATENCY)
+        ignores = False
+        delay = 0
         while (not self.term.is_set()) and (not self.retries):
             try:
-                messages = await pullpoint.PullMessages({"MessageLimit": 100, "Timeout": WAIT_TIME})
-                self.parse(messages)
+                start = time.monotonic()
+                messages = await pullpoint.pull_messages({"MessageLimit": limit, "Timeout": timedelta(seconds=timeout)})
+                elapsed = time.monotonic() - start
+                events = self.parse(messages)
+                self.requests += 1
+                self.events += events
+                if events:
+                    delay = 0
+                elif elapsed < timeout * IGNORE_RATIO:
+                    if not ignores:
+                        ignores = True
+                        self.logger.debug(f"Camera ignores pull timeout, poll within {latency} s")
+                    delay = min(latency, max(delay * 2, latency / 8))
+                self.updateStats("pull", timeout, delay, ignores)
+                if delay > elapsed:
+                    await asyncio.sleep(delay - elapsed)
             except:
                 self.retries += 1
                 if self.retries == 1:
                     self.logger.error("Cannot retrieve (pull) messages")
 
-        self.logger.info("shutdown")
+    async def notifications(self, manager):
+        delivered = False
+        while (not self.term.is_set()) and (not self.retries):
+            try:
+                if delivered:
+                    content = await self.queue.get()
+                else: # the camera should deliver its initial state after the synchronization point
+                    content = await asyncio.wait_for(self.queue.get(), PUSH_TIMEOUT.total_seconds())
+                if content:
+                    delivered = True
+                    messages = manager.process_notifications(content)
+                    if messages:
+                        self.requests += 1
+                        self.events += self.parse(messages)
+                        self.updateStats("push")
+            except asyncio.TimeoutError:
+                self.logger.error("No notifications received, fall back to pullpoint")
+                self.push = False
+                self.retries += 1
+            except:
+                self.retries += 1
+                if self.retries == 1:
+                    self.logger.error("Cannot process notification")
+
+    async def snapshot(self, filename): # runs in a snapshot worker of the hub
+        mycam = self.camera
+        if not mycam:
+            self.logger.debug("No snapshot as camera is not connected")
+            return False
+        if not self.profile:
+            media = await mycam.create_media_service()
+            profiles = await media.GetProfiles()
+            self.profile = profiles[0].token
+        image = await asyncio.wait_for(mycam.get_snapshot(self.profile), SNAPSHOT_TIMEOUT)
+        if not image:
+            self.logger.error("Camera returned no snapshot")
+            return False
+        await asyncio.to_thread(self.writeSnapshot, filename, image)
+        self.logger.debug(f"Snapshot saved to {filename}")
+        return True
+
+    def writeSnapshot(self, filename, image):
+        with open(filename, "wb") as f:
+            f.write(image)
+
+    def unsubscribe(self, listener):
+        listener.unsubscribe(self.camname)
+        self.queue = None
+
+    async def run(self, connect, listener = None, devices = None):
+        while not self.term.is_set():
+            self.retry.attempt()
+            await self.events(connect, listener, devices)
+            if not self.term.is_set():
+                probing = self.retry.state == HALFOPEN
+                delay = self.retry.failure()
+                if self.retry.state == OPEN and not probing:
+                    self.logger.error(f"Camera not available, retry in {delay:.0f} s")
+                else:
+                    self.logger.debug(f"Reconnect in {delay:.1f} s")
+                await asyncio.sleep(delay)
+
+    def enabled(self):
+        return common.getsetting(self.settings, "onvifdetect", True)
+
+    def terminate(self):
+        self.term.set()
+
+#########################################################
+# Class : detectorhub                                   #
+#########################################################
+class detectorhub(Thread):
+    def __init__(self, basename, general, loglevel = logging.CRITICAL):
+        self.logger = logging.getLogger('{}.detectorhub'.format(basename))
+        logging.getLogger("zeep").setLevel(loglevel)
+        logging.getLogger("httpx").setLevel(loglevel)
+        self.loop = asyncio.new_event_loop()
+        self.mutex = Lock()
+        self.detectors = []
+        self.tasks = {}
+        self.listener = notify(basename, general)
+        self.devices = DeviceCache(common.getsetting(general, "devicecache", DEVICE_CACHE) * 3600, get_cache_dir())
+        self.snapshots = None
+        self.workers = common.getsetting(general, "snapshotworkers", SNAPSHOT_WORKERS)
+        self.connect = None
+        self.stopping = None
+        self.running = False
+        Thread.__init__(self)
+
+    def __del__(self):
+        del self.devices
+        del self.listener
+        del self.tasks
+        del self.detectors
+        del self.mutex
+        del self.logger
+
+    def add(self, det): # detectors added before start are connected together
+        if not det.enabled():
+            det.logger.debug("No detection as onvifdetect is not enabled")
+            return
+        with self.mutex:
+            self.detectors.append(det)
+            if self.running:
+                self.loop.call_soon_threadsafe(self.startTask, det)
+
+    def remove(self, det):
+        det.terminate()
+        with self.mutex:
+            if det in self.detectors:
+                self.detectors.remove(det)
+            if self.running:
+                self.loop.call_soon_threadsafe(self.stopTask, det)
+
+    def snapshot(self, det, filename, callback = None): # called from manager threads, never blocks
+        with self.mutex:
+            if self.running and det in self.detectors:
+                self.loop.call_soon_threadsafe(self.queueSnapshot, det, filename, callback)
+                return True
+        return False
+
+    def queueSnapshot(self, det, filename, callback):
         try:
-            await manager.shutdown()
-        except:
-            pass
+            self.snapshots.put_nowait((det, filename, callback))
+        except asyncio.QueueFull:
+            det.logger.error("Too many pending snapshots, snapshot skipped")
+
+    async def snapshotWorker(self):
+        while True:
+            det, filename, callback = await self.snapshots.get()
+            try:
+                result = await det.snapshot(filename)
+            except asyncio.CancelledError:
+                raise
+            except:
+                det.logger.error("Cannot take snapshot")
+                result = False
+            if callback:
+                callback(result)
+
+    def startTask(self, det):
+        self.tasks[det] = self.loop.create_task(det.run(self.connect, self.listener, self.devices))
+
+    def stopTask(self, det):
+        if det in self.tasks:
+            self.tasks.pop(det).cancel()
+
+    async def main(self):
+        self.connect = asyncio.Semaphore(MAX_CONNECTS)
+        self.stopping = asyncio.Event()
+        self.snapshots = asyncio.Queue(SNAPSHOT_QUEUE)
+        workers = [self.loop.create_task(self.snapshotWorker()) for _ in range(self.workers)]
+        if self.listener.enabled():
+            await self.listener.start()
+        with self.mutex:
+            for det in self.detectors:
+                self.startTask(det)
+            self.running = True
+        self.logger.info(f"running, detecting on {len(self.tasks)} cameras")
+        await self.stopping.wait()
+        with self.mutex:
+            self.running = False
+        for det, task in self.tasks.items():
+            det.terminate()
+            task.cancel()
+        for task in workers:
+            task.cancel()
         try:
-            await mycam.close()
-        except: 
-            pass
-        
+            await asyncio.wait_for(asyncio.gather(*self.tasks.values(), *workers, return_exceptions = True), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.logger.error("Not all detectors shut down in time")
+        self.tasks = {}
+        await self.listener.stop()
+
     def run(self):
-        if not common.getsetting(self.settings, "onvifdetect", True):
-            self.logger.debug("No detection as onvifdetect is not enabled")
-            return
-        loop = asyncio.new_event_loop()
-        while not self.term.is_set():
-            if self.retries > 10:
-                time.sleep(1)
-            loop.run_until_complete(self.events())
-        
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+        self.logger.info("terminating")
+
     def terminate(self):
-        self.term.set()
+        with self.mutex:
+            if self.running:
+                self.loop.call_soon_threadsafe(self.stopping.set)
 #########################################################
           
 ######################### MAIN ##########################
@@ -130,6 +130,8 @@ class mqtt(object):
             dev["mdl"] = self.base.loadModel(devname)
             dev["ids"] = [ ids ]
             for topic in topics:
+                if not topic["type"]: # no homeassistant entity, e.g. request and response topics
+                    continue
                 discotopic = self.buildDiscoTopic(devname, topic, hatopic)
                 disco = dumps(self.buildDisco(devname, topic, ids, dev))
                 self.client.publish(discotopic, disco, QOS, RETAIN)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : notify.py                                   #
+#           Receives ONVIF notifications pushed by      #
+#           cameras and routes them per camera          #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import asyncio
+import logging
+import socket
+from urllib.parse import quote, unquote
+from common.common import common
+#########################################################
+
+####################### GLOBALS #########################
+DEFAULTPORT = 12466
+READ_TIMEOUT = 10 # s
+MAX_CONTENT = 1048576 # bytes
+MAX_QUEUED = 100 # notifications per camera
+
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : notify                                        #
+#########################################################
+class notify(object):
+    def __init__(self, basename, general):
+        self.logger = logging.getLogger('{}.notify'.format(basename))
+        self.host = common.getsetting(general, "notifyhost", "")
+        self.port = common.getsetting(general, "notifyport", DEFAULTPORT)
+        self.queues = {}
+        self.senders = {} # addresses of the camera, only accepted as sender of its notifications
+        self.server = None
+
+    def __del__(self):
+        del self.senders
+        del self.queues
+        del self.logger
+
+    def enabled(self):
+        return self.host != ""
+
+    async def start(self):
+        try:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port) # only on the address given to the cameras
+            self.logger.info(f"listening for notifications on {self.host}:{self.port}")
+        except Exception as e:
+            self.logger.error(f"Cannot listen for notifications on {self.host}:{self.port}")
+            self.logger.error(e)
+            self.server = None
+        return self.server != None
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def running(self):
+        return self.server != None
+
+    def address(self, camname): # consumer reference address for the subscription of this camera
+        return f"http://{self.host}:{self.port}/{quote(camname, safe='')}"
+
+    async def subscribe(self, camname, host):
+        self.senders[camname] = await self.resolve(host)
+        self.queues[camname] = asyncio.Queue(MAX_QUEUED)
+        return self.queues[camname]
+
+    def unsubscribe(self, camname):
+        if camname in self.queues:
+            del self.queues[camname]
+        if camname in self.senders:
+            del self.senders[camname]
+
+    async def resolve(self, host): # addresses of a camera host, the host itself if it cannot be resolved
+        addresses = {host}
+        try:
+            for info in await asyncio.get_running_loop().getaddrinfo(host, None, type = socket.SOCK_STREAM):
+                addresses.add(info[4][0])
+        except Exception as e:
+            self.logger.debug(f"Cannot resolve {host}: {e}")
+        return addresses
+
+    def sender(self, camname, peer): # peer address, also as IPv4 mapped IPv6 address
+        address = str(peer[0]) if peer else ""
+        if address.startswith("::ffff:"):
+            address = address[7:]
+        return address in self.senders.get(camname, ())
+
+    async def handle(self, reader, writer):
+        status = "400 Bad Request"
+        try:
+            request = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            method, path, _ = request.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if method != "POST" or length <= 0 or length > MAX_CONTENT:
+                status = "400 Bad Request"
+            else:
+                content = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT)
+                camname = unquote(path.strip("/").split("/")[0]) # quoted in the address
+                if not camname in self.queues:
+                    status = "404 Not Found"
+                    self.logger.debug(f"Notification for unknown subscription {path}")
+                elif not self.sender(camname, writer.get_extra_info("peername")):
+                    status = "403 Forbidden"
+                    self.logger.debug(f"Notification for {camname} from {writer.get_extra_info('peername')} rejected, not sent by the camera")
+                else:
+                    try:
+                        self.queues[camname].put_nowait(content)
+                        status = "200 OK"
+                    except asyncio.QueueFull:
+                        status = "503 Service Unavailable"
+                        self.logger.debug(f"Notification queue full for {camname}, dropped")
+        except Exception as e:
+            self.logger.debug(f"Invalid notification request: {e}")
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            writer.close()
+        except:
+            pass
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
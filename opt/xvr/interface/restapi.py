@@ -18,6 +18,7 @@ from common.common import common
 ####################### GLOBALS #########################
 HOSTNAME = "" #"localhost"
 DEFAULTPORT = 12465
+EVENTS = "events" # query of the timeline
 
 #########################################################
 
@@ -112,6 +113,8 @@ class restHandler(BaseHTTPRequestHandler):
                 device = self.devices[0]
             if not device.lower() in self.devices:
                 self.response(False, error="Unknown device")
+            elif tag == EVENTS:
+                self.handleEvents(device, query)
             elif query:
                 if tag:
                     self.response(False, error="Tag not allowed in set request")
@@ -171,6 +174,17 @@ class restHandler(BaseHTTPRequestHandler):
         except:
             self.response(False, error="Incorrect data format")
 
+    def handleEvents(self, device, query):
+        #http://localhost:port/device/events?from=2024-12-09T22:00&to=2024-12-10T07:00&type=person,vehicle&offset=0&limit=100
+        try:
+            response = self.base.query(device, query)
+            if response != None:
+                self.response(True, response)
+            else:
+                self.response(False, error="No timeline on this device")
+        except:
+            self.response(False, error="Incorrect events query")
+
     def setValue(self, device, tag, value):
         with self.mutex:
             if not device in self.values.keys():
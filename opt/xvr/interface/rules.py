@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : rules.py                                    #
+#           Map onvif event topics to detection types   #
+#                                                       #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import logging
+from common.common import common
+#########################################################
+
+####################### GLOBALS #########################
+# topic patterns: segments separated by /, * matches one segment, a final ** matches all remaining segments
+DEFAULT_RULES = [{"topic": "RuleEngine/CellMotionDetector/Motion",         "type": "motion"},
+                 {"topic": "RuleEngine/MotionRegionDetector/Motion",       "type": "motion"},
+                 {"topic": "RuleEngine/MyRuleDetector/DogCatDetect",       "type": "pet"},
+                 {"topic": "RuleEngine/MyRuleDetector/VehicleDetect",      "type": "vehicle"},
+                 {"topic": "RuleEngine/MyRuleDetector/PeopleDetect",       "type": "person"},
+                 {"topic": "RuleEngine/TPSmartEventDetector/TPSmartEvent", "type": "person"},
+                 {"topic": "RuleEngine/PeopleDetector/People",             "type": "person"}]
+WILDCARD = "*"
+DEEPWILDCARD = "**"
+ONVALUE = "true"
+MAX_CACHED = 1024 # topics with their matching rules
+
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : rule                                          #
+#########################################################
+class rule(object):
+    def __init__(self, index, settings):
+        self.index = index
+        self.type = settings["type"]
+        self.source = dict(common.getsetting(settings, "source", {}))
+        self.data = common.getsetting(settings, "data")
+        self.onvalue = str(common.getsetting(settings, "value", ONVALUE)).lower()
+
+    def match(self, mes): # returns the state or None if the rule doesn't match
+        for name, value in self.source.items():
+            if mes.source.get(name) != str(value):
+                return None
+        if self.data:
+            value = mes.data.get(self.data)
+        else:
+            value = next(iter(mes.data.values()), None)
+        if value == None:
+            return None
+        return value.lower() == self.onvalue
+
+#########################################################
+# Class : rules                                         #
+#########################################################
+class rules(object):
+    def __init__(self, basename, camname, settings):
+        self.logger = logging.getLogger('{}.rules [{}]'.format(basename, camname))
+        self.root = self.node()
+        self.types = []
+        self.cache = {}
+        self.compile(list(common.getsetting(settings, "onvifrules", [])) + DEFAULT_RULES)
+
+    def __del__(self):
+        del self.cache
+        del self.root
+        del self.logger
+
+    def node(self):
+        return {"next": {}, "rules": [], "deep": []}
+
+    @classmethod
+    def split(cls, topic): # strip namespace prefixes, tns1:RuleEngine/tt:Motion --> [RuleEngine, Motion]
+        return [segment.rpartition(":")[2] for segment in topic.strip().strip("/").split("/")]
+
+    def compile(self, settings): # build a trie on topic segments, rules keep their order of definition
+        for index, ruleSettings in enumerate(settings):
+            try:
+                newRule = rule(index, ruleSettings)
+                segments = self.split(ruleSettings["topic"])
+            except:
+                self.logger.error(f"Invalid onvif rule: {ruleSettings}")
+                continue
+            node = self.root
+            deep = segments[-1] == DEEPWILDCARD
+            if deep:
+                segments = segments[:-1]
+            for segment in segments:
+                node = node["next"].setdefault(segment, self.node())
+            node["deep" if deep else "rules"].append(newRule)
+            if newRule.type not in self.types:
+                self.types.append(newRule.type)
+
+    def lookup(self, topic): # rules matching a topic, cached per topic so repeated topics cost a dict lookup
+        candidates = self.cache.get(topic)
+        if candidates == None:
+            found = []
+            self.walk(self.root, self.split(topic), 0, found)
+            candidates = sorted(found, key=lambda r: r.index)
+            if len(self.cache) >= MAX_CACHED:
+                self.cache.clear()
+            self.cache[topic] = candidates
+        return candidates
+
+    def walk(self, node, segments, level, found):
+        found.extend(node["deep"])
+        if level == len(segments):
+            found.extend(node["rules"])
+            return
+        for key in dict.fromkeys((segments[level], WILDCARD)):
+            child = node["next"].get(key)
+            if child:
+                self.walk(child, segments, level + 1, found)
+
+    def match(self, mes): # returns detection type and state, or None, None if no rule matches
+        for candidate in self.lookup(mes.topic):
+            state = candidate.match(mes)
+            if state != None:
+                return candidate.type, state
+        return None, None
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
@@ -19,6 +19,15 @@ import logging.handlers
 import locale
 from common.common import common
 from process.manager import manager
+from process.supervisor import supervisor
+from process.scheduler import scheduler
+from process.allocator import allocator
+from process.timelinewriter import timelinewriter
+from process.maintainer import maintainer
+from process.timeline import timeline
+from common.layout import layout
+from interface.detector import detectorhub
+from onvif.doccache import set_cache_dir
 import yaml
 from interface.restapi import restapi
 from interface.mqtt import mqtt
@@ -39,6 +48,8 @@ DOCKER_LOG = "log"
 GENERAL_LOG = "." #"/var/log"
 DOCKER_CAMERAS = "/cameras"
 DOCKER_RESTAPIPORT = 8081
+DOCKER_CACHE = "cache"
+GENERAL_CACHE = os.path.join("~", ".cache", APP_NAME)
 DEFAULT_YML = "./xvr_default.yml"
 LOG_MAXSIZE  = 100*1024*1024
 
@@ -60,6 +71,12 @@ class xvr(object):
         self.cameras = {}
         self.mqtt = None
         self.restapi = None
+        self.supervisor = None
+        self.scheduler = None
+        self.allocator = None
+        self.writer = None
+        self.maintainer = None
+        self.hub = None
         self.term = Event()
         self.term.clear()
         self.loglevel = logging.DEBUG
@@ -67,6 +84,7 @@ class xvr(object):
         self.logger = logging.getLogger(APP_NAME)
         self.logger.setLevel(self.loglevel)
         self.exitval = 0
+        self.migrate = False
         fh = logging.handlers.RotatingFileHandler(self.GetLogger(), maxBytes=LOG_MAXSIZE, backupCount=5)
         ch = logging.StreamHandler(sys.stdout)
         self.logger.addHandler(fh)
@@ -90,10 +108,26 @@ class xvr(object):
         signal.signal(signal.SIGTERM, self.exit_app)
         self.handleArgs(argv)
         self.setlogger()
-        
+        if self.migrate:
+            self.migrateLayout()
+            return self.exitval
+        set_cache_dir(self.GetCache())
+
+        self.supervisor = supervisor(APP_NAME)
+        self.supervisor.start()
+        self.scheduler = scheduler(APP_NAME)
+        self.scheduler.start()
+        self.allocator = allocator(APP_NAME, common.getsetting(self.settings, "general", {}))
+        self.allocator.start()
+        self.writer = timelinewriter(APP_NAME, common.getsetting(self.settings, "general", {}))
+        self.writer.start()
+        self.maintainer = maintainer(APP_NAME)
+        self.maintainer.start()
+        self.hub = detectorhub(APP_NAME, common.getsetting(self.settings, "general", {}))
         for camname, data in common.getsetting(self.settings, "cameras", {}).items():
-            self.cameras[camname] = manager(APP_NAME, camname, data, common.getsetting(self.settings, "general", {}), self.getcb)
+            self.cameras[camname] = manager(APP_NAME, camname, data, common.getsetting(self.settings, "general", {}), self.getcb, self.supervisor, self.scheduler, self.hub, self.allocator, self.writer, self.maintainer)
             self.cameras[camname].start()
+        self.hub.start() # connect all cameras at once
         devices = list(self.cameras.keys())
         devices.append("general")
         self.restapi=restapi(self, APP_NAME, common.getsetting(self.settings, "restapi"), devices)
@@ -112,6 +146,25 @@ class xvr(object):
             if self.cameras[camname]:
                 self.cameras[camname].terminate()
                 self.cameras[camname].join(5)
+
+        if self.hub != None:
+            self.hub.terminate()
+            self.hub.join(5)
+        if self.supervisor != None:
+            self.supervisor.terminate()
+            self.supervisor.join(5)
+        if self.scheduler != None:
+            self.scheduler.terminate()
+            self.scheduler.join(5)
+        if self.maintainer != None:
+            self.maintainer.terminate()
+            self.maintainer.join(5)
+        if self.allocator != None:
+            self.allocator.terminate()
+            self.allocator.join(5)
+        if self.writer != None: # after the cameras, entries of the last detections are written
+            self.writer.terminate()
+            self.writer.join(5)
         
         if self.mqtt != None:
             self.mqtt.terminate()
@@ -167,6 +220,11 @@ class xvr(object):
         except:
             pass
         return retval
+
+    def query(self, camname, query): # timeline query from the restapi, errors are reported to the requester
+        if camname in self.cameras:
+            return self.cameras[camname].queryEvents(query)
+        return None
         
     def GetLogger(self):
         if self.docker:
@@ -187,6 +245,21 @@ class xvr(object):
                 exit(1)
         return (LoggerPath)
     
+    def GetCache(self):
+        if self.docker:
+            cachepath = os.path.join(DOCKER_BASE, DOCKER_CACHE)
+        else:
+            cachepath = common.getsetting(common.getsetting(self.settings, "general", {}), "cachefolder", GENERAL_CACHE)
+        if cachepath: # empty disables caching
+            cachepath = os.path.expanduser(cachepath)
+        if cachepath and not os.path.exists(cachepath):
+            try:
+                os.makedirs(cachepath, mode = 0o700)
+            except:
+                self.logger.error("Cannot create cache folder, caching disabled")
+                cachepath = None
+        return cachepath
+
     def GetYml(self):
         if self.docker:
             ymlpath = os.path.join(DOCKER_BASE, DOCKER_CFG)
@@ -225,6 +298,8 @@ class xvr(object):
             arg = sys.argv[1]
             if arg == "-h" or arg == "--help":
                 self.printHelp()
+            elif arg == "-m" or arg == "--migrate":
+                self.migrate = True
             else:
                 self.logger.error("Incorrect argument entered")
                 self.printError()
@@ -242,6 +317,21 @@ class xvr(object):
             self.logger.error("yaml file not found")
             self.printError()
 
+    def migrateLayout(self): # move recordings of flat camera folders into date partitions
+        general = common.getsetting(self.settings, "general", {})
+        fileLayout = layout(general)
+        if not fileLayout.partitioned():
+            self.logger.info("Folder layout is flat, nothing to migrate")
+            return
+        for camname, data in common.getsetting(self.settings, "cameras", {}).items():
+            path = os.path.abspath(os.path.join(common.getsetting(general, "videofolder", "."), camname))
+            try:
+                moved = fileLayout.migrate(path)
+                timeline(APP_NAME, camname, data, general, path).renameFiles(moved)
+                self.logger.info(f"{camname}: moved {len(moved)} files to {fileLayout.mode} folders")
+            except Exception as e:
+                self.logger.error(f"{camname}: cannot migrate recordings: {e}") # no error exit, the launcher would restart
+
     def setlogger(self):
         settingsGeneral = common.getsetting(self.settings, "general")
         if settingsGeneral:
@@ -258,6 +348,7 @@ class xvr(object):
     def printHelp(self):
         print("Option:")
         print("    -h, --help: print this help file and exit")
+        print("    -m, --migrate: move recordings to the folder layout in /etc/xvr.yml and exit")
         print(" ")
         print("Enter options in /etc/xvr.yml")
         exit(0)
@@ -10,22 +10,23 @@ from typing import Any
 from collections.abc import Callable
 
 import httpx
-from httpx import AsyncClient, BasicAuth, DigestAuth
-from zeep.cache import SqliteCache
+from httpx import BasicAuth, DigestAuth
 from zeep.client import AsyncClient as BaseZeepAsyncClient
 import zeep.helpers
 from zeep.proxy import AsyncServiceProxy
-from zeep.transports import AsyncTransport
 from zeep.wsdl import Document
 from zeep.wsse.username import UsernameToken
 
 from onvif.definition import SERVICES
 from onvif.exceptions import ONVIFAuthError, ONVIFError, ONVIFTimeoutError
 
-from .const import KEEPALIVE_EXPIRY
+from .compiled import COMPILED_OPERATIONS, CompiledRequests, compile_request
+from .devicecache import DeviceCache, DeviceInfo
+from .doccache import load_document, save_document
 from .managers import NotificationManager, PullPointManager
+from .parsers import NotificationsRecord, notifications_from_zeep, parse_notifications
 from .settings import DEFAULT_SETTINGS
-from .transport import ASYNC_TRANSPORT
+from .transport import ASYNC_TRANSPORT, TRANSPORTS
 from .types import FastDateTime
 from .util import create_no_verify_ssl_context, normalize_url, path_isfile, utcnow
 from .wrappers import retry_connection_error  # noqa: F401
@@ -42,7 +43,6 @@ _PULLPOINT_TIMEOUT = 90
 _CONNECT_TIMEOUT = 30
 _READ_TIMEOUT = 90
 _WRITE_TIMEOUT = 90
-_HTTPX_LIMITS = httpx.Limits(keepalive_expiry=KEEPALIVE_EXPIRY)
 _NO_VERIFY_SSL_CONTEXT = create_no_verify_ssl_context()
 
 
@@ -103,6 +103,9 @@ async def _cached_document(url: str) -> Document:
     loop = asyncio.get_event_loop()
 
     def _load_document() -> DocumentWithDeferredLoad:
+        document = load_document(url)
+        if document is not None:
+            return document
         document = DocumentWithDeferredLoad(
             url, ASYNC_TRANSPORT, settings=DEFAULT_SETTINGS
         )
@@ -117,6 +120,7 @@ async def _cached_document(url: str) -> Document:
         document.types.add_documents([None], url)
         # Perform the original load
         document.original_load(url)
+        save_document(url, document)
         return document
 
     document = await loop.run_in_executor(None, _load_document)
@@ -213,22 +217,8 @@ class ONVIFService:
             read=read_timeout or _READ_TIMEOUT,
             write=write_timeout or _WRITE_TIMEOUT,
         )
-        client = AsyncClient(
-            verify=_NO_VERIFY_SSL_CONTEXT, timeout=timeouts, limits=_HTTPX_LIMITS
-        )
-        # The wsdl client should never actually be used, but it is required
-        # to avoid creating another ssl context since the underlying code
-        # will try to create a new one if it doesn't exist.
-        wsdl_client = httpx.Client(
-            verify=_NO_VERIFY_SSL_CONTEXT, timeout=timeouts, limits=_HTTPX_LIMITS
-        )
-        self.transport = (
-            AsyncTransport(client=client, wsdl_client=wsdl_client)
-            if no_cache
-            else AsyncTransport(
-                client=client, wsdl_client=wsdl_client, cache=SqliteCache()
-            )
-        )
+        self.transport = TRANSPORTS.acquire(timeouts, _NO_VERIFY_SSL_CONTEXT, no_cache)
+        self._closed = False
         self.document: Document | None = None
         self.zeep_client_authless: ZeepAsyncClient | None = None
         self.ws_client_authless: AsyncServiceProxy | None = None
@@ -236,6 +226,8 @@ class ONVIFService:
         self.ws_client: AsyncServiceProxy | None = None
         self.create_type: Callable | None = None
         self.loop = asyncio.get_event_loop()
+        self._compiled = CompiledRequests()
+        self._wrappers: dict[str, Callable] = {}
 
     async def setup(self):
         """Setup the transport."""
@@ -270,9 +262,84 @@ class ONVIFService:
         )
         self.create_type = lambda x: self.zeep_client.get_element(active_ns + ":" + x)()
 
+    @property
+    def closed(self) -> bool:
+        """Return True if the service is closed."""
+        return self._closed or self.transport.client.is_closed
+
     async def close(self):
-        """Close the transport."""
-        await self.transport.aclose()
+        """Release the shared transport."""
+        if not self._closed:
+            self._closed = True
+            await TRANSPORTS.release(self.transport)
+
+    def params_raw(self, name: str, params: Any = None) -> dict[str, Any]:
+        """Return the params of an operation as keyword arguments.
+
+        A single value is passed as the first input parameter, like zeep does.
+        """
+        if params is None:
+            return {}
+        params = ONVIFService.to_dict(params)
+        if isinstance(params, dict):
+            return params
+        elements = self.ws_client._binding.get(name).input.body.type.elements
+        return {elements[0][0]: params}
+
+    def render_raw(self, name: str, params: Any = None) -> tuple[Any, dict[str, str]]:
+        """Render the request of an operation without sending it.
+
+        Hot operations are rendered from a compiled request, others by zeep.
+        """
+        proxy = self.ws_client
+        kwargs = self.params_raw(name, params)
+        if name not in COMPILED_OPERATIONS:
+            return proxy._binding._create(
+                name, (), kwargs, client=proxy._client, options=proxy._binding_options
+            )
+        request = self._compiled.get(name, kwargs)
+        if request is None:
+            envelope, http_headers = proxy._binding._create(
+                name, (), kwargs, client=proxy._client, options=proxy._binding_options
+            )
+            request = compile_request(
+                envelope, http_headers, self.user, self.passwd, self.dt_diff, kwargs
+            )
+            self._compiled.add(name, kwargs, request)
+        return request.render(kwargs), request.http_headers
+
+    async def post_raw(self, content: Any, http_headers: dict[str, str]) -> Any:
+        """Send a rendered request and return the raw response."""
+        address = self.ws_client._binding_options["address"]
+        if not isinstance(content, bytes):
+            return await self.transport.post_xml(address, content, http_headers)
+        response = await self.transport.post(address, content, http_headers)
+        return self.transport.new_response(response)
+
+    async def call_raw(self, name: str, params: Any = None) -> Any:
+        """Call an operation and return the raw response without processing it."""
+        return await self.post_raw(*self.render_raw(name, params))
+
+    def process_raw(self, name: str, response: Any) -> Any:
+        """Process a raw response with zeep."""
+        proxy = self.ws_client
+        return proxy._binding.process_reply(
+            proxy._client, proxy._binding.get(name), response
+        )
+
+    async def pull_messages(self, params: Any = None) -> NotificationsRecord:
+        """PullMessages returning a compact record.
+
+        The reply is read with the fast parser, zeep is used for faults and
+        anything the fast parser does not understand.
+        """
+        response = await self.call_raw("PullMessages", params)
+        record = None
+        if response.status_code == 200:
+            record = parse_notifications(response.content)
+        if record is None:
+            record = notifications_from_zeep(self.process_raw("PullMessages", response))
+        return record
 
     @staticmethod
     @safe_func
@@ -309,12 +376,32 @@ class ONVIFService:
 
             return wrapped
 
+        def compiled_wrapper(name):
+            """Wrap a compiled service call."""
+
+            async def call(content, http_headers):
+                return self.process_raw(name, await self.post_raw(content, http_headers))
+
+            @safe_func
+            def wrapped(params=None):
+                return call(*self.render_raw(name, params))
+
+            return wrapped
+
         builtin = name.startswith("__") and name.endswith("__")
         if builtin:
             return self.__dict__[name]
-        if name.startswith("authless_"):
-            return service_wrapper(getattr(self.ws_client_authless, name.split("_")[1]))
-        return service_wrapper(getattr(self.ws_client, name))
+        wrappers = self.__dict__.setdefault("_wrappers", {})
+        wrapper = wrappers.get(name)
+        if wrapper is None:
+            if name.startswith("authless_"):
+                wrapper = service_wrapper(getattr(self.ws_client_authless, name.split("_")[1]))
+            elif name in COMPILED_OPERATIONS:
+                wrapper = compiled_wrapper(name)
+            else:
+                wrapper = service_wrapper(getattr(self.ws_client, name))
+            wrappers[name] = wrapper
+        return wrapper
 
 
 class ONVIFCamera:
@@ -348,6 +435,7 @@ class ONVIFCamera:
         encrypt=True,
         no_cache=False,
         adjust_time=False,
+        device_cache: DeviceCache | None = None,
     ) -> None:
         os.environ.pop("http_proxy", None)
         os.environ.pop("https_proxy", None)
@@ -359,6 +447,7 @@ class ONVIFCamera:
         self.encrypt = encrypt
         self.no_cache = no_cache
         self.adjust_time = adjust_time
+        self.device_cache = device_cache
         self.dt_diff = None
         self.xaddrs = {}
         self._has_broken_relative_timestamps: bool = False
@@ -370,7 +459,7 @@ class ONVIFCamera:
         self.to_dict = ONVIFService.to_dict
 
         self._snapshot_uris = {}
-        self._snapshot_client = AsyncClient(verify=_NO_VERIFY_SSL_CONTEXT)
+        self._snapshot_transport = None
 
     async def get_capabilities(self) -> dict[str, Any]:
         """Get device capabilities."""
@@ -378,6 +467,27 @@ class ONVIFCamera:
             await self.update_xaddrs()
         return self._capabilities
 
+    def restore_xaddrs(self) -> bool:
+        """Restore xaddrs and clock offset from the device cache.
+
+        Returns False if the device is not cached, call update_xaddrs then.
+        """
+        if self.device_cache is None:
+            return False
+        info = self.device_cache.get(self.host, self.port)
+        if info is None:
+            return False
+        self.xaddrs = dict(info.xaddrs)
+        self.dt_diff = info.dt_diff
+        self._capabilities = info.capabilities
+        logger.debug("%s: Restored cached device info", self.host)
+        return True
+
+    def invalidate_xaddrs(self) -> None:
+        """Remove the device from the device cache."""
+        if self.device_cache is not None:
+            self.device_cache.invalidate(self.host, self.port)
+
     async def update_xaddrs(self):
         """Update xaddrs for services."""
         self.dt_diff = None
@@ -417,6 +527,12 @@ class ONVIFCamera:
             self._capabilities = self.to_dict(capabilities)
         except Exception:
             logger.exception("Failed to parse capabilities")
+        if self.device_cache is not None:
+            self.device_cache.put(
+                self.host,
+                self.port,
+                DeviceInfo(dict(self.xaddrs), self.dt_diff, self._capabilities),
+            )
 
     def has_broken_relative_time(
         self,
@@ -502,7 +618,9 @@ class ONVIFCamera:
 
     async def close(self) -> None:
         """Close all transports."""
-        await self._snapshot_client.aclose()
+        if self._snapshot_transport:
+            await TRANSPORTS.release(self._snapshot_transport)
+            self._snapshot_transport = None
         for service in self.services.values():
             await service.close()
 
@@ -549,7 +667,11 @@ class ONVIFCamera:
                 auth = DigestAuth(self.user, self.passwd)
 
         try:
-            response = await self._snapshot_client.get(uri, auth=auth)
+            if self._snapshot_transport is None:
+                self._snapshot_transport = TRANSPORTS.acquire(
+                    httpx.Timeout(_DEFAULT_TIMEOUT), _NO_VERIFY_SSL_CONTEXT
+                )
+            response = await self._snapshot_transport.client.get(uri, auth=auth)
         except httpx.TimeoutException as error:
             raise ONVIFTimeoutError(error) from error
         except httpx.RequestError as error:
@@ -0,0 +1,148 @@
+"""Precompiled SOAP requests for hot ONVIF operations."""
+
+from __future__ import annotations
+
+import base64
+from collections import OrderedDict
+import datetime as dt
+import hashlib
+import os
+import re
+from typing import Any
+import uuid
+from xml.sax.saxutils import escape
+
+from lxml import etree
+from zeep import ns
+from zeep.wsdl.utils import etree_to_string
+
+# Operations called in a loop by the detector
+COMPILED_OPERATIONS = ("PullMessages", "Renew", "SetSynchronizationPoint")
+# Text params that change per call, rendered in a hole instead of being part of the key
+COMPILED_HOLES = ("TerminationTime",)
+# Compiled requests kept per service, the other params are part of the key
+_MAX_COMPILED = 8
+
+_PASSWORD_DIGEST = "PasswordDigest"
+_MARKER = "__onvif_{}_{}__"
+
+
+class CompiledRequest:
+    """A rendered request envelope with holes for the fields that change per call.
+
+    Only the WS-Addressing MessageID, the WS-Security nonce, created and
+    digest and the params in COMPILED_HOLES change between calls with the
+    same other parameters, all other content is rendered once by zeep.
+    """
+
+    def __init__(
+        self,
+        chunks: list[str],
+        fields: list[str],
+        http_headers: dict[str, str],
+        username: str | None,
+        password: str | None,
+        dt_diff: dt.timedelta | None,
+    ) -> None:
+        """Initialize the compiled request."""
+        self.chunks = chunks
+        self.fields = fields
+        self.http_headers = http_headers
+        self.password = (password or "").encode("utf-8")
+        self.username = username
+        self.dt_diff = dt_diff
+
+    def render(self, params: dict[str, Any] | None = None) -> bytes:
+        """Render the envelope with fresh nonce, timestamp, message id and holes."""
+        values = {"MessageID": "urn:uuid:" + str(uuid.uuid4())}
+        for name in COMPILED_HOLES:
+            if name in self.fields:
+                values[name] = escape((params or {})[name])
+        if "Nonce" in self.fields:
+            nonce = os.urandom(16)
+            created = dt.datetime.now(tz=dt.timezone.utc).replace(tzinfo=None)
+            if self.dt_diff is not None:
+                created += self.dt_diff
+            timestamp = created.replace(microsecond=0, tzinfo=dt.timezone.utc).isoformat()
+            values["Nonce"] = base64.b64encode(nonce).decode("ascii")
+            values["Created"] = timestamp
+            values["Password"] = base64.b64encode(
+                hashlib.sha1(nonce + timestamp.encode("utf-8") + self.password).digest()
+            ).decode("ascii")
+        parts = [self.chunks[0]]
+        for field, chunk in zip(self.fields, self.chunks[1:]):
+            parts.append(values[field])
+            parts.append(chunk)
+        return "".join(parts).encode("utf-8")
+
+
+def holes_of(params: dict[str, Any]) -> tuple[str, ...]:
+    """Return the params rendered in a hole."""
+    return tuple(
+        name for name in COMPILED_HOLES if isinstance(params.get(name), str)
+    )
+
+
+def compile_request(
+    envelope: Any,
+    http_headers: dict[str, str],
+    username: str | None,
+    password: str | None,
+    dt_diff: dt.timedelta | None,
+    params: dict[str, Any] | None = None,
+) -> CompiledRequest:
+    """Compile a zeep rendered envelope (with wsse and ws-addressing applied)."""
+    token = uuid.uuid4().hex
+    holes = holes_of(params or {})
+    for element in envelope.iter():
+        if not isinstance(element.tag, str):
+            continue
+        if element.tag == "{%s}MessageID" % ns.WSA:
+            element.text = _MARKER.format("MessageID", token)
+        elif element.tag == "{%s}Nonce" % ns.WSSE:
+            element.text = _MARKER.format("Nonce", token)
+        elif element.tag == "{%s}Created" % ns.WSU:
+            element.text = _MARKER.format("Created", token)
+        elif element.tag == "{%s}Password" % ns.WSSE and (
+            element.get("Type") or ""
+        ).endswith(_PASSWORD_DIGEST):
+            element.text = _MARKER.format("Password", token)
+        elif etree.QName(element).localname in holes:
+            element.text = _MARKER.format(etree.QName(element).localname, token)
+    content = etree_to_string(envelope).decode("utf-8")
+    fields = "|".join(("MessageID", "Nonce", "Created", "Password") + COMPILED_HOLES)
+    pieces = re.split(_MARKER.format("(" + fields + ")", token), content)
+    return CompiledRequest(
+        pieces[0::2], pieces[1::2], http_headers, username, password, dt_diff
+    )
+
+
+class CompiledRequests:
+    """Small LRU of compiled requests for one service."""
+
+    def __init__(self) -> None:
+        """Initialize the cache."""
+        self._requests: OrderedDict[tuple[str, str], CompiledRequest] = OrderedDict()
+
+    @staticmethod
+    def _key(name: str, params: dict[str, Any]) -> tuple[str, str]:
+        """Return the key of an operation and params, holes only by name."""
+        holes = holes_of(params)
+        params = [
+            (key, None if key in holes else value) for key, value in params.items()
+        ]
+        return name, repr((sorted(params), holes))
+
+    def get(self, name: str, params: dict[str, Any]) -> CompiledRequest | None:
+        """Return the compiled request for an operation and params."""
+        key = self._key(name, params)
+        request = self._requests.get(key)
+        if request is not None:
+            self._requests.move_to_end(key)
+        return request
+
+    def add(self, name: str, params: dict[str, Any], request: CompiledRequest) -> None:
+        """Store a compiled request."""
+        self._requests[self._key(name, params)] = request
+        while len(self._requests) > _MAX_COMPILED:
+            self._requests.popitem(last=False)
@@ -0,0 +1,119 @@
+"""Cache of device capabilities, xaddrs and clock offset across reconnects."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import datetime as dt
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any
+
+logger = logging.getLogger("onvif")
+
+_CACHE_VERSION = 1
+DEFAULT_TTL = 86400  # s
+
+
+@dataclass(slots=True)
+class DeviceInfo:
+    """What update_xaddrs learns from a device."""
+
+    xaddrs: dict[str, str]
+    dt_diff: dt.timedelta | None = None
+    capabilities: dict[str, Any] | None = None
+    updated: float = field(default_factory=time.time)
+
+
+class DeviceCache:
+    """Device info per host and port, in memory and optionally on disk."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, path: str | None = None) -> None:
+        """Initialize the cache, path None keeps the cache in memory only."""
+        self.ttl = ttl
+        self.path = path
+        self._devices: dict[tuple[str, int], DeviceInfo] = {}
+
+    def get(self, host: str, port: int) -> DeviceInfo | None:
+        """Return the cached info if not expired."""
+        info = self._devices.get((host, port))
+        if info is None:
+            info = self._load(host, port)
+        if info is None:
+            return None
+        if time.time() - info.updated > self.ttl:
+            self.invalidate(host, port)
+            return None
+        self._devices[(host, port)] = info
+        return info
+
+    def put(self, host: str, port: int, info: DeviceInfo) -> None:
+        """Store info of a device."""
+        self._devices[(host, port)] = info
+        self._save(host, port, info)
+
+    def invalidate(self, host: str, port: int) -> None:
+        """Forget a device, e.g. when it faults on a cached address."""
+        logger.debug("%s: Invalidate cached device info", host)
+        self._devices.pop((host, port), None)
+        filename = self._filename(host, port)
+        if filename and os.path.isfile(filename):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def _filename(self, host: str, port: int) -> str | None:
+        """Return the cache file of a device."""
+        if not self.path:
+            return None
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", host)
+        return os.path.join(self.path, f"device-{name}-{port}.json")
+
+    def _load(self, host: str, port: int) -> DeviceInfo | None:
+        """Load info of a device from disk."""
+        filename = self._filename(host, port)
+        if not filename or not os.path.isfile(filename):
+            return None
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            if data.get("version") != _CACHE_VERSION:
+                return None
+            dt_diff = data.get("dt_diff")
+            return DeviceInfo(
+                data["xaddrs"],
+                None if dt_diff is None else dt.timedelta(seconds=dt_diff),
+                None,
+                data["updated"],
+            )
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logger.debug("%s: Cannot load cached device info: %s", host, err)
+        return None
+
+    def _save(self, host: str, port: int, info: DeviceInfo) -> None:
+        """Save info of a device to disk, capabilities are kept in memory only."""
+        filename = self._filename(host, port)
+        if not filename:
+            return
+        data = {
+            "version": _CACHE_VERSION,
+            "xaddrs": info.xaddrs,
+            "dt_diff": None if info.dt_diff is None else info.dt_diff.total_seconds(),
+            "updated": info.updated,
+        }
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmpname, filename)
+            except BaseException:
+                os.remove(tmpname)
+                raise
+        except OSError as err:
+            logger.debug("%s: Cannot cache device info: %s", host, err)
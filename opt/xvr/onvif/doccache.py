@@ -0,0 +1,168 @@
+"""Persistent on-disk cache of parsed WSDL documents."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from typing import Any
+
+from lxml import etree
+import zeep
+from zeep.wsdl import Document
+
+from .settings import DEFAULT_SETTINGS
+from .transport import ASYNC_TRANSPORT
+
+logger = logging.getLogger("onvif")
+
+_CACHE_VERSION = 2
+_CACHE_EXTENSION = ".pickle"
+_DYNAMIC_MODULES = ("zeep.xsd.dynamic_types",)
+_VALUE_MODULES = ("zeep.objects",)
+_SHARED = {"settings": DEFAULT_SETTINGS, "transport": ASYNC_TRANSPORT}
+
+_cache_dir: str | None = None
+
+
+def set_cache_dir(path: str | None) -> None:
+    """Set the folder for cached documents, None disables the cache."""
+    global _cache_dir
+    _cache_dir = path
+
+
+def get_cache_dir() -> str | None:
+    """Return the folder for cached documents."""
+    return _cache_dir
+
+
+def _dynamic_type(name: str, bases: tuple[type, ...], attributes: dict[str, Any]) -> type:
+    """Recreate a type zeep created while parsing the schema."""
+    return type(name, bases, attributes)
+
+
+class _DocumentPickler(pickle.Pickler):
+    """Pickler for zeep documents.
+
+    Shared settings and transport are stored by reference, lxml objects and
+    the types zeep creates at runtime are rebuilt on load.
+    """
+
+    def persistent_id(self, obj: Any) -> str | None:
+        for key, shared in _SHARED.items():
+            if obj is shared:
+                return key
+        return None
+
+    def reducer_override(self, obj: Any) -> Any:
+        if isinstance(obj, etree.QName):
+            return etree.QName, (obj.text,)
+        if isinstance(obj, etree._Element):
+            return etree.fromstring, (etree.tostring(obj),)
+        if type(obj).__name__ in ("odict_values", "dict_values"):
+            return list, (list(obj),)
+        if isinstance(obj, type):
+            if obj.__module__ in _DYNAMIC_MODULES:
+                attributes = {
+                    key: value
+                    for key, value in obj.__dict__.items()
+                    if key in ("__module__", "_xsd_name")
+                }
+                return _dynamic_type, (obj.__name__, obj.__bases__, attributes)
+            if obj.__module__ in _VALUE_MODULES and hasattr(obj, "_xsd_type"):
+                # Value classes are cached properties of their xsd type
+                prop = "_array_class" if obj.__bases__[0].__name__ == "ArrayValue" else "_value_class"
+                return getattr, (obj._xsd_type, prop)
+        return NotImplemented
+
+
+class _DocumentUnpickler(pickle.Unpickler):
+    """Unpickler for zeep documents."""
+
+    def persistent_load(self, pid: str) -> Any:
+        return _SHARED[pid]
+
+
+def _imported(document: Document) -> list[str]:
+    """Return the local files the document was parsed from, including imports."""
+    locations = {doc._location for doc in document.types.documents if doc._location}
+    seen = set()
+    pending = list(document._definitions.values())
+    while pending:
+        definition = pending.pop()
+        if id(definition) in seen:
+            continue
+        seen.add(id(definition))
+        locations.add(definition.location)
+        pending.extend(definition.imports.values())
+    return sorted(path for path in locations if path and os.path.isfile(path))
+
+
+def _sources(paths: list[str]) -> list[tuple[str, int, int]]:
+    """Return path, mtime and size of the files a document was parsed from."""
+    sources = []
+    for path in paths:
+        stat = os.stat(path)
+        sources.append((path, stat.st_mtime_ns, stat.st_size))
+    return sources
+
+
+def _trusted(f: Any) -> bool:
+    """Return whether an open cache file is owned and writable by the current user only."""
+    stat = os.fstat(f.fileno())
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def _cache_file(url: str) -> str | None:
+    """Return the cache file for a document."""
+    if not _cache_dir:
+        return None
+    key = "{}|{}|{}|{}".format(
+        _CACHE_VERSION, zeep.__version__, sys.version_info[:2], os.path.abspath(url)
+    )
+    name = os.path.basename(url) + "-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(_cache_dir, name + _CACHE_EXTENSION)
+
+
+def load_document(url: str) -> Document | None:
+    """Load a document from the cache, None if not cached or outdated."""
+    filename = _cache_file(url)
+    if not filename or not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, "rb") as f:
+            if not _trusted(f):
+                logger.debug("Cached document %s is not private to the current user", url)
+                return None
+            sources = pickle.load(f)
+            if sources != _sources([source[0] for source in sources]):
+                logger.debug("Cached document %s is outdated", url)
+                return None
+            return _DocumentUnpickler(f).load()
+    except Exception as err:  # pylint: disable=broad-except
+        logger.debug("Cannot load cached document %s: %s", url, err)
+    return None
+
+
+def save_document(url: str, document: Document) -> None:
+    """Save a document to the cache."""
+    filename = _cache_file(url)
+    if not filename:
+        return
+    try:
+        os.makedirs(_cache_dir, mode=0o700, exist_ok=True)
+        sources = _sources(_imported(document))
+        fd, tmpname = tempfile.mkstemp(dir=_cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(sources, f)
+                _DocumentPickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(document)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+    except Exception as err:  # pylint: disable=broad-except
+        logger.debug("Cannot cache document %s: %s", url, err)
@@ -17,6 +17,7 @@ from zeep.wsdl.bindings.soap import SoapOperation
 
 from onvif.exceptions import ONVIFError
 
+from .parsers import NotificationsRecord, notifications_from_zeep, parse_notifications
 from .settings import DEFAULT_SETTINGS
 from .transport import ASYNC_TRANSPORT
 from .util import normalize_url, stringify_onvif_error
@@ -63,7 +64,7 @@ class BaseManager:
     @property
     def closed(self) -> bool:
         """Return True if the manager is closed."""
-        return not self._subscription or self._subscription.transport.client.is_closed
+        return not self._subscription or self._subscription.closed
 
     async def start(self) -> None:
         """Setup the manager."""
@@ -287,6 +288,16 @@ class NotificationManager(BaseManager):
                 return None
         return self._operation.process_reply(envelope)
 
+    def process_notifications(self, content: bytes) -> NotificationsRecord | None:
+        """Process a notification message into a compact record."""
+        record = parse_notifications(content)
+        if record is None:
+            result = self.process(content)
+            if result is None:
+                return None
+            record = notifications_from_zeep(result)
+        return record
+
 
 class PullPointManager(BaseManager):
     """Manager for PullPoint."""
@@ -0,0 +1,167 @@
+"""Fast parsers for ONVIF event replies."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import datetime as dt
+from io import BytesIO
+import logging
+from typing import Any
+
+import ciso8601
+from lxml import etree
+
+logger = logging.getLogger("onvif")
+
+_REPLIES = ("PullMessagesResponse", "Notify")
+
+
+@dataclass(slots=True)
+class NotificationRecord:
+    """A single notification message."""
+
+    topic: str
+    utc_time: dt.datetime | None = None
+    property_operation: str | None = None
+    source: dict[str, str] = field(default_factory=dict)
+    data: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class NotificationsRecord:
+    """The notification messages of a PullMessagesResponse or Notify."""
+
+    current_time: dt.datetime | None = None
+    termination_time: dt.datetime | None = None
+    messages: list[NotificationRecord] = field(default_factory=list)
+
+
+def _localname(tag: Any) -> str:
+    """Return the tag without namespace."""
+    return tag.rpartition("}")[2] if isinstance(tag, str) else ""
+
+
+def _parse_datetime(value: str | None) -> dt.datetime | None:
+    """Parse an xsd:dateTime, None if empty or invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if len(value) > 10 and value[10] == "-":  # 2010-01-01-00:00:00...
+        value = value[:10] + "T" + value[11:]
+    try:
+        return ciso8601.parse_datetime(value)
+    except ValueError:
+        return None
+
+
+def _simple_items(element: etree._Element) -> dict[str, str]:
+    """Return the Name/Value pairs of the SimpleItems in a Source or Data element."""
+    return {
+        item.get("Name"): item.get("Value")
+        for item in element
+        if _localname(item.tag) == "SimpleItem"
+    }
+
+
+def _notification(element: etree._Element) -> NotificationRecord | None:
+    """Parse a NotificationMessage, None if not understood."""
+    topic = None
+    message = None
+    for child in element:
+        name = _localname(child.tag)
+        if name == "Topic":
+            topic = (child.text or "").strip()
+        elif name == "Message":
+            message = next(iter(child), None)
+    if not topic or message is None or _localname(message.tag) != "Message":
+        return None
+    record = NotificationRecord(
+        topic,
+        _parse_datetime(message.get("UtcTime")),
+        message.get("PropertyOperation"),
+    )
+    for child in message:
+        name = _localname(child.tag)
+        if name == "Source":
+            record.source = _simple_items(child)
+        elif name == "Data":
+            record.data = _simple_items(child)
+    return record
+
+
+def parse_notifications(content: bytes) -> NotificationsRecord | None:
+    """Parse a PullMessagesResponse or Notify envelope.
+
+    Only the fields used for event detection are read. Returns None for
+    anything unexpected (faults, other replies, unknown message layout), so
+    the caller can fall back to zeep.
+    """
+    record = NotificationsRecord()
+    in_body = False
+    reply = None
+    try:
+        for event, element in etree.iterparse(
+            BytesIO(content),
+            events=("start", "end"),
+            resolve_entities=False,
+            no_network=True,
+            huge_tree=True,
+        ):
+            name = _localname(element.tag)
+            if event == "start":
+                if reply is None:
+                    if in_body:
+                        if name not in _REPLIES:
+                            return None
+                        reply = element
+                    elif name == "Body":
+                        in_body = True
+                continue
+            if reply is None or element.getparent() is not reply:
+                continue
+            if name == "NotificationMessage":
+                message = _notification(element)
+                if message is None:
+                    return None
+                record.messages.append(message)
+            elif name == "CurrentTime":
+                record.current_time = _parse_datetime(element.text)
+            elif name == "TerminationTime":
+                record.termination_time = _parse_datetime(element.text)
+            element.clear()
+    except etree.LxmlError as err:
+        logger.debug("Fast parser cannot parse reply: %s", err)
+        return None
+    if reply is None:
+        return None
+    return record
+
+
+def notifications_from_zeep(result: Any) -> NotificationsRecord:
+    """Convert a zeep PullMessagesResponse or Notify result to a record."""
+    record = NotificationsRecord()
+    if result is None:
+        return record
+    record.current_time = getattr(result, "CurrentTime", None)
+    record.termination_time = getattr(result, "TerminationTime", None)
+    for nm in getattr(result, "NotificationMessage", None) or []:
+        try:
+            topic = nm.Topic._value_1
+            message = nm.Message._value_1
+        except AttributeError:
+            continue
+        notification = NotificationRecord(
+            topic,
+            getattr(message, "UtcTime", None),
+            getattr(message, "PropertyOperation", None),
+        )
+        for name in ("Source", "Data"):
+            items = getattr(message, name, None)
+            if items is not None and items.SimpleItem:
+                setattr(
+                    notification,
+                    name.lower(),
+                    {item.Name: item.Value for item in items.SimpleItem},
+                )
+        record.messages.append(notification)
+    return record
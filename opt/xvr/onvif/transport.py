@@ -2,12 +2,30 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
 import os.path
+import ssl
 
-from zeep.transports import Transport
+import httpx
+from zeep.cache import SqliteCache
+from zeep.transports import AsyncTransport, Transport
 
+from .const import KEEPALIVE_EXPIRY
 from .util import path_isfile
 
+logger = logging.getLogger("onvif")
+
+# Long-polls keep one connection busy per camera, so the number of
+# connections is not capped, only the idle keep-alive connections are.
+_MAX_CONNECTIONS = None
+_MAX_KEEPALIVE_CONNECTIONS = 100
+HTTPX_LIMITS = httpx.Limits(
+    max_connections=_MAX_CONNECTIONS,
+    max_keepalive_connections=_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+)
+
 
 class AsyncSafeTransport(Transport):
     """A transport that blocks all remote I/O for zeep."""
@@ -21,3 +39,62 @@ class AsyncSafeTransport(Transport):
 
 
 ASYNC_TRANSPORT = AsyncSafeTransport()
+
+
+class TransportRegistry:
+    """Process wide registry of shared, reference counted transports.
+
+    All services with the same timeouts on the same event loop share one
+    transport: one keep-alive connection pool per host, one TLS context and
+    one zeep cache. A transport is closed when its last service releases it.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the registry."""
+        self._transports: dict[tuple, list] = {}
+        self._cache: SqliteCache | None = None
+
+    def acquire(
+        self, timeouts: httpx.Timeout, verify: ssl.SSLContext, no_cache: bool = False
+    ) -> AsyncTransport:
+        """Return a shared transport, create it if needed."""
+        key = (id(asyncio.get_event_loop()), repr(timeouts), no_cache)
+        entry = self._transports.get(key)
+        if entry is None or entry[0].client.is_closed:
+            client = httpx.AsyncClient(verify=verify, timeout=timeouts, limits=HTTPX_LIMITS)
+            # The wsdl client should never actually be used, but it is required
+            # to avoid creating another ssl context since the underlying code
+            # will try to create a new one if it doesn't exist.
+            wsdl_client = httpx.Client(verify=verify, timeout=timeouts, limits=HTTPX_LIMITS)
+            if no_cache:
+                transport = AsyncTransport(client=client, wsdl_client=wsdl_client)
+            else:
+                if self._cache is None:
+                    self._cache = SqliteCache()
+                transport = AsyncTransport(
+                    client=client, wsdl_client=wsdl_client, cache=self._cache
+                )
+            entry = [transport, 0]
+            self._transports[key] = entry
+            logger.debug("Created shared transport %s", key)
+        entry[1] += 1
+        return entry[0]
+
+    async def release(self, transport: AsyncTransport) -> None:
+        """Release a shared transport, close it when no longer used."""
+        for key, entry in list(self._transports.items()):
+            if entry[0] is transport:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._transports[key]
+                    logger.debug("Closing shared transport %s", key)
+                    await transport.aclose()
+                return
+        await transport.aclose()
+
+    def count(self) -> int:
+        """Return the number of open transports."""
+        return len(self._transports)
+
+
+TRANSPORTS = TransportRegistry()
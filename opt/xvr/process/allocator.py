@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : allocator.py                                #
+#           Global storage budget, fair-share           #
+#           eviction across cameras                     #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+from threading import Thread, Event, Lock
+import logging
+import os
+from common.common import common
+
+#########################################################
+
+####################### GLOBALS #########################
+MB2B      = 1024*1024
+QUOTA_LOW = 90 # %, files are removed until below this part of the budget
+SMOOTHING = 0.2 # weight of a new bitrate measurement
+MIN_FREE  = 0 # MB, free disk space floor, 0 = no floor
+FREE_HYSTERESIS = 1.1 # free space to reach when the floor is passed
+MAX_FREE  = 1 << 62 # free space if it cannot be determined
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : allocator                                     #
+#########################################################
+class allocator(Thread):
+    def __init__(self, basename, general):
+        self.logger = logging.getLogger('{}.allocator'.format(basename))
+        self.budget = common.getsetting(general, "maxsizemb", 0) * MB2B
+        self.lowmark = self.budget * common.getsetting(general, "quotalow", QUOTA_LOW) / 100
+        self.minfree = common.getsetting(general, "minfreemb", MIN_FREE) * MB2B
+        self.mutex = Lock()
+        self.cameras = {}
+        self.term = Event()
+        self.term.clear()
+        self.wake = Event()
+        self.wake.clear()
+        Thread.__init__(self)
+
+    def __del__(self):
+        del self.cameras
+        del self.wake
+        del self.term
+        del self.mutex
+        del self.logger
+
+    def enabled(self):
+        return self.budget > 0 or self.minfree > 0
+
+    def register(self, camname, storage, settings, cbKeep = None): # cbKeep returns the files that cannot be removed
+        with self.mutex:
+            self.cameras[camname] = {
+                "storage": storage,
+                "weight": common.getsetting(settings, "storageweight", 1),
+                "minimum": common.getsetting(settings, "storagemin", 0) * MB2B,
+                "bitrate": 0,
+                "keep": cbKeep
+            }
+
+    def unregister(self, camname):
+        with self.mutex:
+            self.cameras.pop(camname, None)
+
+    def setBitrate(self, camname, kbs): # measured by the recorder, smoothed
+        if kbs > 0:
+            with self.mutex:
+                if camname in self.cameras:
+                    cam = self.cameras[camname]
+                    cam["bitrate"] = kbs if not cam["bitrate"] else cam["bitrate"] + SMOOTHING * (kbs - cam["bitrate"])
+
+    def total(self):
+        with self.mutex:
+            return sum(cam["storage"].total for cam in self.cameras.values())
+
+    def check(self): # cheap, called when a file is closed and on the quota timer
+        if (self.budget > 0 and self.total() > self.budget) or self.lowDisks():
+            self.wake.set()
+
+    def freeSpace(self, path):
+        try:
+            st = os.statvfs(path)
+            return st.f_bavail * st.f_frsize
+        except:
+            return MAX_FREE
+
+    def disks(self): # cameras per filesystem, as the free space floor is shared by all cameras on a disk
+        disks = {}
+        with self.mutex:
+            for name, cam in self.cameras.items():
+                try:
+                    disks.setdefault(os.stat(cam["storage"].path).st_dev, []).append((name, cam))
+                except:
+                    pass
+        return disks
+
+    def lowDisks(self): # cameras of the disks below the free space floor
+        if self.minfree <= 0:
+            return []
+        return [cams for cams in self.disks().values() if self.freeSpace(cams[0][1]["storage"].path) < self.minfree]
+
+    def evictOldest(self, cams): # remove the oldest file of all cameras on a disk, files without events first, False if nothing to remove
+        candidates = []
+        for name, cam in cams:
+            candidate = cam["storage"].first(cam["keep"]() if cam["keep"] else ())
+            if candidate:
+                candidates.append((candidate, name, cam))
+        if not candidates:
+            return False
+        (events, mtime, filename), name, cam = min(candidates, key = lambda item: item[0])
+        cam["storage"].remove(filename)
+        self.logger.debug(f"Cleanup video files of {name} on free disk space: deleted {filename}")
+        return True
+
+    def enforceFree(self):
+        try:
+            for cams in self.lowDisks():
+                path = cams[0][1]["storage"].path
+                self.logger.info("Low free disk space, removing oldest files")
+                while not self.term.is_set() and self.freeSpace(path) < self.minfree * FREE_HYSTERESIS:
+                    if not self.evictOldest(cams):
+                        if self.freeSpace(path) < self.minfree:
+                            self.logger.error("Low free disk space, but no more files to remove")
+                        break
+        except:
+            self.logger.error("Cannot remove files on free disk space")
+
+    def shares(self): # share of the budget per camera, on weight and bitrate, at least the minimum guarantee
+        known = [cam["bitrate"] for cam in self.cameras.values() if cam["bitrate"]]
+        default = sum(known) / len(known) if known else 1
+        needs = {name: cam["weight"] * (cam["bitrate"] or default) for name, cam in self.cameras.items()}
+        total = sum(needs.values()) or 1
+        return {name: max(self.cameras[name]["minimum"], self.lowmark * need / total) for name, need in needs.items()}
+
+    def evict(self): # remove the oldest file of the camera furthest above its share, False if nothing to remove
+        with self.mutex:
+            shares = self.shares()
+            ranked = sorted(self.cameras.items(), key = lambda item: item[1]["storage"].total - shares[item[0]], reverse = True)
+        for name, cam in ranked:
+            if cam["storage"].total <= cam["minimum"]:
+                continue
+            keep = cam["keep"]() if cam["keep"] else ()
+            for filename, size in cam["storage"].oldest():
+                if filename not in keep:
+                    cam["storage"].remove(filename)
+                    self.logger.debug(f"Cleanup video files of {name}: deleted {filename}")
+                    return True
+        return False
+
+    def enforce(self):
+        self.logger.debug("Storage budget exceeded, cleaning up")
+        try:
+            while not self.term.is_set() and self.total() > self.lowmark:
+                if not self.evict():
+                    self.logger.error("Storage budget exceeded, but no more files to remove")
+                    break
+        except:
+            self.logger.error("Cannot remove files on storage budget")
+
+    def run(self):
+        if not self.enabled():
+            return
+        self.logger.info("running, storage budget {:.0f} MB, free disk space floor {:.0f} MB".format(self.budget / MB2B, self.minfree / MB2B))
+        while not self.term.is_set():
+            self.wake.wait()
+            self.wake.clear()
+            if not self.term.is_set() and self.budget > 0 and self.total() > self.budget:
+                self.enforce()
+            if not self.term.is_set():
+                self.enforceFree()
+        self.logger.info("terminating")
+
+    def terminate(self):
+        self.term.set()
+        self.wake.set()
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
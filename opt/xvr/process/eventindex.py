@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : eventindex.py                               #
+#           index of the timeline for queries on time   #
+#           and type without reading the file           #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import logging
+import os
+import json
+import sqlite3
+from threading import Lock
+from datetime import datetime
+
+#########################################################
+
+####################### GLOBALS #########################
+INDEXFILE     = ".timeline.db"
+MEMORYFILE    = ":memory:" # fallback if the index cannot be stored, synced from the timeline on every start anyway
+VERSION       = 2 # index layout, an index with another layout is recreated
+TIMEFORMAT    = "%Y-%m-%d %H:%M:%S"
+COLUMNS       = ("time", "type", "filename", "filetime", "duration", "snapshot", "snapshotpeak")
+DEFAULT_LIMIT = 100
+MAX_LIMIT     = 1000
+BATCH         = 1000 # entries inserted at once when syncing
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : eventindex                                    #
+#########################################################
+class eventindex(object):
+    def __init__(self, basename, camname, path):
+        self.logger = logging.getLogger('{}.eventindex [{}]'.format(basename, camname))
+        self.path = path
+        self.mutex = Lock()
+        self.db = None
+        if self.path:
+            try:
+                self.db = self.connect(os.path.join(self.path, INDEXFILE))
+            except:
+                self.logger.error("Cannot open event index, keeping it in memory")
+                self.db = self.connect(MEMORYFILE)
+
+    def __del__(self):
+        self.close()
+        del self.mutex
+        del self.logger
+
+    def connect(self, filename):
+        db = sqlite3.connect(filename, check_same_thread = False, isolation_level = None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if db.execute("PRAGMA user_version").fetchone()[0] != VERSION:
+            db.execute("DROP TABLE IF EXISTS events")
+            db.execute("DROP TABLE IF EXISTS synced")
+            db.execute(f"PRAGMA user_version={VERSION}")
+        # start: offset of the entry in the timeline, counted from the first entry ever written, so removing old entries doesn't move it
+        db.execute("CREATE TABLE IF NOT EXISTS events (start INTEGER PRIMARY KEY, time REAL NOT NULL, type TEXT NOT NULL, filename TEXT, filetime TEXT, duration INTEGER, snapshot TEXT, snapshotpeak TEXT)")
+        db.execute("CREATE INDEX IF NOT EXISTS events_time ON events (time)")
+        db.execute("CREATE INDEX IF NOT EXISTS events_type ON events (type, time)")
+        # position: end of the indexed part, base: bytes removed from the start of the timeline, both counted like start
+        db.execute("CREATE TABLE IF NOT EXISTS synced (position INTEGER NOT NULL, base INTEGER NOT NULL)")
+        if not db.execute("SELECT COUNT(*) FROM synced").fetchone()[0]:
+            db.execute("INSERT INTO synced (position, base) VALUES (0, 0)")
+        return db
+
+    def close(self):
+        with self.mutex:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+    def row(self, start, entry):
+        return (start, self.timestamp(entry["time"])) + tuple(entry.get(column, "") for column in COLUMNS[1:])
+
+    @classmethod
+    def timestamp(cls, text): # fixed format 2024-12-09 15:53:15, much faster than strptime
+        return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]), int(text[11:13]), int(text[14:16]), int(text[17:19])).timestamp()
+
+    def reset(self): # called before the timeline is rewritten, so an interrupted rewrite is fully indexed on the next sync
+        with self.mutex:
+            if self.db:
+                self.db.execute("DELETE FROM events")
+                self.db.execute("UPDATE synced SET position = 0, base = 0")
+
+    def drop(self, removed): # the first removed bytes are cut from the timeline, returns False if the index needs a reset
+        with self.mutex:
+            if self.db:
+                position, base = self.db.execute("SELECT position, base FROM synced").fetchone()
+                if position - base < removed:
+                    return False
+                self.db.execute("BEGIN")
+                self.db.execute("DELETE FROM events WHERE start < ?", (base + removed,))
+                self.db.execute("UPDATE synced SET base = ?", (base + removed,))
+                self.db.execute("COMMIT")
+        return True
+
+    def sync(self, filename): # index the part of the timeline that is not indexed yet, all of it if the timeline was rewritten
+        if not self.db or not filename:
+            return
+        try:
+            with self.mutex:
+                position, base = self.db.execute("SELECT position, base FROM synced").fetchone()
+                size = os.path.getsize(filename)
+                if size == position - base:
+                    return
+                self.db.execute("BEGIN")
+                try:
+                    if size < position - base:
+                        self.logger.debug("Timeline was rewritten, rebuilding event index")
+                        self.db.execute("DELETE FROM events")
+                        position = base = 0
+                    count = 0
+                    rows = []
+                    with open(filename, "rb") as f:
+                        f.seek(position - base)
+                        for line in f:
+                            if not line.endswith(b"\n"): # partly written line, indexed on the next sync
+                                break
+                            try:
+                                rows.append(self.row(position, json.loads(line)))
+                            except:
+                                pass
+                            position += len(line)
+                            if len(rows) >= BATCH:
+                                count += self.insert(rows)
+                    count += self.insert(rows)
+                    self.db.execute("UPDATE synced SET position = ?, base = ?", (position, base))
+                    self.db.execute("COMMIT")
+                except:
+                    self.db.execute("ROLLBACK")
+                    raise
+            self.logger.debug(f"Indexed {count} timeline entries")
+        except:
+            self.logger.error("Cannot sync event index with timeline")
+
+    def insert(self, rows): # inserts and clears rows, returns the number of rows
+        self.db.executemany(f"INSERT OR REPLACE INTO events (start, {', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        count = len(rows)
+        rows.clear()
+        return count
+
+    def query(self, start = None, end = None, types = None, offset = 0, limit = DEFAULT_LIMIT): # newest first, with the total number of matching events
+        conditions = []
+        params = []
+        if start != None:
+            conditions.append("time >= ?")
+            params.append(start)
+        if end != None:
+            conditions.append("time < ?")
+            params.append(end)
+        if types:
+            conditions.append(f"type IN ({', '.join('?' * len(types))})")
+            params.extend(types)
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        limit = max(0, min(int(limit), MAX_LIMIT))
+        offset = max(0, int(offset))
+        with self.mutex:
+            if not self.db:
+                return {"count": 0, "offset": offset, "events": []}
+            count = self.db.execute("SELECT COUNT(*) FROM events" + where, params).fetchone()[0]
+            rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM events{where} ORDER BY time DESC LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        events = []
+        for row in rows:
+            event = dict(zip(COLUMNS, row))
+            event["time"] = datetime.fromtimestamp(event["time"]).strftime(TIMEFORMAT)
+            events.append(event)
+        return {"count": count, "offset": offset, "events": events}
+
+    @classmethod
+    def parseTime(cls, value): # seconds since epoch or local date (time), e.g. 2024-12-09 or 2024-12-09T22:00
+        if value == None or value == "":
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(str(value)).timestamp()
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
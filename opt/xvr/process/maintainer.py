@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : maintainer.py                               #
+#           Runs slow disk work (cleanup, quota and     #
+#           export) of all cameras on one thread        #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+from threading import Thread, Condition
+from collections import deque
+import logging
+
+#########################################################
+
+####################### GLOBALS #########################
+
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : maintainer                                    #
+#########################################################
+class maintainer(Thread):
+    def __init__(self, basename):
+        self.logger = logging.getLogger('{}.maintainer'.format(basename))
+        self.condition = Condition()
+        self.jobs = deque() # waiting jobs in order of arrival, each job at most once
+        self.current = None # running job
+        self.running = True
+        Thread.__init__(self)
+
+    def __del__(self):
+        del self.jobs
+        del self.logger
+
+    def post(self, job): # called from the manager threads, a job that is already waiting is not added again
+        with self.condition:
+            if self.running and job not in self.jobs:
+                self.jobs.append(job)
+                self.condition.notify_all()
+
+    def discard(self, job, timeout = None): # removes a waiting job and waits until it is not running anymore
+        with self.condition:
+            while job in self.jobs:
+                self.jobs.remove(job)
+            return self.condition.wait_for(lambda: self.current != job, timeout)
+
+    def next(self):
+        # returns the next job, None if terminated
+        with self.condition:
+            self.current = None
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.jobs or not self.running)
+            if self.running:
+                self.current = self.jobs.popleft()
+            return self.current
+
+    def run(self):
+        self.logger.info("running")
+        while job := self.next():
+            try:
+                job()
+            except Exception as e:
+                self.logger.exception(e)
+        self.logger.info("terminating")
+
+    def terminate(self):
+        with self.condition:
+            self.running = False
+            self.jobs.clear()
+            self.condition.notify_all()
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
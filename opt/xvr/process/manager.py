@@ -8,22 +8,29 @@
 
 ####################### IMPORTS #########################
 from threading import Thread, Lock, Event
+from collections import deque
 import logging
-from time import sleep
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+from json import dumps, loads
 from common.common import common
+from common.reconnect import reconnect
+from common.layout import layout
 from process.topics.topics import topics
 from interface.detector import detector
 from recorder.recorder import recorder
 from process.wiper import wiper
+from process.storage import storage
 from process.timeline import timeline
 
 #########################################################
 
 ####################### GLOBALS #########################
-RETRY_WAIT  = 600 # 600 x 100 ms = 60 s
 CLEANUPTIME = datetime(1900,1,1,3,0,0,0).time() # 3:00, 0:00 doesn't work, 0:01 does
+MQTTONLY    = 1 # interface for query responses over mqtt, restapi answers the request itself
+RESTONLY    = 2 # interface for statistics, only available on restapi
+QUOTA_CHECK = 60 # s, free disk space is also checked while no files are closed
+SNAPSHOTEXTENSION = ".jpg"
 
 #########################################################
 
@@ -35,7 +42,7 @@ CLEANUPTIME = datetime(1900,1,1,3,0,0,0).time() # 3:00, 0:00 doesn't work, 0:01
 # Class : manager                                       #
 #########################################################
 class manager(Thread):
-    def __init__(self, basename, camname, settings, general, cbget):
+    def __init__(self, basename, camname, settings, general, cbget, supervisor = None, scheduler = None, hub = None, allocator = None, writer = None, maintainer = None):
         self.logger = logging.getLogger('{}.manager [{}]'.format(basename, camname))
         self.camname = camname
         self.settings = settings
@@ -47,15 +54,42 @@ class manager(Thread):
         self.mutex = Lock()
         self.term = Event()
         self.term.clear()
+        self.wake = Event()
+        self.wake.clear()
+        self.tasks = deque() # callbacks of other threads, run on the manager thread
+        self.maintainer = maintainer # runs maintenance of all cameras
+        self.cleanupDue = False
+        self.quotaDue = False
+        self.exportDue = None
+        self.stats = {}
+        self.supervisor = supervisor
+        self.scheduler = scheduler
+        self.detectionTimer = self.timer(self.detectionTimeout, "detection")
+        self.stopTimer = self.timer(self.stopTimeout, "recordstop")
+        self.rolloverTimer = self.timer(self.rolloverTimeout, "rollover")
+        self.retryTimer = self.timer(self.retryTimeout, "retry")
+        self.upkeepTimer = self.timer(self.upkeepTimeout, "upkeep")
+        self.cleanupTimer = self.timer(self.cleanupTimeout, "cleanup")
+        self.snapshotTimer = self.timer(self.snapshotTimeout, "snapshot")
+        self.quotaTimer = self.timer(self.quotaTimeout, "quota")
         self.continuerec = common.getsetting(self.settings, "continuerec", False)
         self.topics = None
         self.enable = True
         self.record = False
-        self.cleaned = False
-        self.stream = recorder(basename, camname, self.settings, self.path, self.setRecording)
-        self.detector = detector(basename, camname, self.settings, self.manageDetection)
-        self.wiper = wiper(basename, camname, self.settings, self.path)
-        self.timeline = timeline(basename, camname, self.settings, self.general, self.path)
+        self.cleaned = None
+        self.streamRetry = reconnect(general, self.streamState)
+        self.layout = layout(general)
+        self.timeline = timeline(basename, camname, self.settings, self.general, self.path, writer)
+        self.storage = storage(basename, camname, self.path, self.layout, self.timeline.getEventFiles)
+        self.stream = recorder(basename, camname, self.settings, self.general, self.path, self.setRecording, supervisor, self.streamEvent, self.fileEvent, self.layout)
+        self.detector = detector(basename, camname, self.settings, self.general,
+                                 lambda topicType, detect: self.post(self.manageDetection, topicType, detect),
+                                 lambda stats: self.post(self.detectorStats, stats), lambda state: self.post(self.detectorState, state))
+        self.hub = hub
+        self.hub.add(self.detector)
+        self.wiper = wiper(basename, camname, self.settings, self.path, self.storage, self.layout)
+        self.allocator = allocator
+        self.allocator.register(camname, self.storage, self.settings, self.openFiles)
         Thread.__init__(self)
 
     def __del__(self):
@@ -67,8 +101,13 @@ class manager(Thread):
             del self.detector
         if self.stream:
             del self.stream
+        if self.storage:
+            del self.storage
         if self.topics:
             del self.topics
+        del self.stats
+        del self.tasks
+        del self.wake
         del self.term
         del self.mutex
         del self.logger
@@ -82,42 +121,179 @@ class manager(Thread):
     def terminate(self):
         self.logger.info("terminating")
         self.term.set()
+        self.wake.set()
         if self.detector:
-            self.detector.terminate()
-            self.detector.join(5)
+            self.hub.remove(self.detector)
+        self.allocator.unregister(self.camname)
 
     def run(self):
         self.logger.info("running")
         self.loadTopics()
-        self.detector.start()
-        retry = 0
-        if self.continuerec:
-            if not self.stream.start():
-                retry = RETRY_WAIT
-                self.logger.error(f"Error starting recording, retry in {retry/10} s")
-        maxfilesize = common.getsetting(self.settings, "maxfilesize", 3600)
+        with self.mutex:
+            self.storage.check()
+            if self.startStream():
+                self.streamRetry.success()
+            else:
+                self.setRetry()
+        self.cleanupTimer.arm(self.nextCleanup())
+        self.quotaTimer.armIn(QUOTA_CHECK)
         while not self.term.is_set():
+            self.wake.wait() # woken for callbacks of timers and the detector hub
+            self.wake.clear()
+            while self.tasks and not self.term.is_set():
+                task, args = self.tasks.popleft()
+                try:
+                    task(*args)
+                except Exception as e:
+                    self.logger.exception(e)
+        self.maintainer.discard(self.maintenance, 5)
+        for tmr in (self.detectionTimer, self.stopTimer, self.rolloverTimer, self.retryTimer, self.upkeepTimer, self.cleanupTimer, self.snapshotTimer, self.quotaTimer):
+            tmr.cancel()
+        with self.mutex:
+            self.stream.stop()
+            self.stream.stopBuffer()
+            self.storage.close()
+
+    def timer(self, callback, name): # timers of all cameras expire on the scheduler thread, their callbacks run on the manager thread
+        return self.scheduler.timer(callback, self.camname, name, self.post)
+
+    def post(self, task, *args): # called from other threads, which never wait for the mutex this way
+        self.tasks.append((task, args))
+        self.wake.set()
+
+    def maintenance(self): # slow disk work on the maintainer thread, so callbacks on the manager thread are not held up
+        if self.term.is_set():
+            return
+        if self.cleanupDue: # files are removed without the mutex, the storage index has its own lock
+            self.cleanupDue = False
+            self.quotaDue = False
+            self.wiper.cleanup(self.openFiles())
+            self.timeline.cleanup() # the timeline has its own lock for rewriting
+        if self.quotaDue:
+            self.quotaDue = False
+            self.wiper.enforce(self.openFiles())
+        if self.exportDue != None:
+            fmt = self.exportDue
+            self.exportDue = None
+            self.timeline.export(fmt)
+
+    def streamEvent(self, event): # called from the supervisor thread, which never waits for the mutex this way
+        self.post(self.handleStream, event, self.supervisor.defer())
+
+    def handleStream(self, event, resume): # posted by the supervisor, the fd is selected again once handled
+        try:
             with self.mutex:
-                self.manageDetectionStop()
-                if self.stream.recording():
-                    errcode = self.stream.poll()
-                    if errcode != None: # recording process is stopped
-                        self.logger.error(f"Recording exited with errorcode {errcode}")
-                        if self.continuerec:
-                            retry = RETRY_WAIT
-                    elif self.stream.getData()["time_s"] > maxfilesize:
-                        if not self.stream.restart():
-                            retry = RETRY_WAIT
-                            self.logger.error(f"Error restarting recording, retry in {retry/10} s")
-                if retry:
-                    retry -= 1
-                    if retry == 0:
-                        if not self.stream.start():
-                            retry = RETRY_WAIT
-                            self.logger.error(f"Error starting recording, retry in {retry/10} s")
-                self.checkCleanup()
-            sleep(0.1)
-        self.stream.stop()
+                self.checkStream(self.stream.handle(event))
+        finally:
+            resume()
+
+    def checkStream(self, errcode):
+        if errcode != None: # recording process is stopped
+            self.logger.error(f"Recording exited with errorcode {errcode}")
+            if self.continuerec:
+                self.setRetry(False)
+            elif self.stream.prebuffer: # keep what is buffered, restart buffer
+                self.stream.stop()
+                self.setRetry(False)
+
+    def setRetry(self, log = True, action = "starting"):
+        delay = self.streamRetry.failure()
+        self.retryTimer.armIn(delay)
+        if log:
+            self.logger.error(f"Error {action} recording, retry in {delay:.0f} s")
+
+    # timer callbacks, posted by the scheduler
+    def detectionTimeout(self):
+        with self.mutex:
+            self.manageDetectionStop()
+            self.timerStats()
+
+    def stopTimeout(self):
+        with self.mutex:
+            self.stream.stop()
+            self.timerStats()
+
+    def rolloverTimeout(self):
+        with self.mutex:
+            if self.stream.recording() and not self.stream.segmented:
+                if not self.stream.restart():
+                    self.setRetry(True, "restarting")
+            self.timerStats()
+
+    def retryTimeout(self):
+        with self.mutex:
+            self.streamRetry.attempt()
+            if self.startStream():
+                self.streamRetry.success()
+            else:
+                self.setRetry()
+            self.timerStats()
+
+    def upkeepTimeout(self):
+        with self.mutex:
+            self.checkStream(self.stream.poll())
+            self.armUpkeep()
+
+    def cleanupTimeout(self):
+        self.cleaned = datetime.now().date()
+        self.cleanupTimer.arm(self.nextCleanup())
+        self.cleanupDue = True
+        self.maintainer.post(self.maintenance)
+        self.timerStats()
+
+    def snapshotTimeout(self):
+        with self.mutex:
+            if self.detecting:
+                self.takeSnapshot("peak")
+            self.timerStats()
+
+    def quotaTimeout(self):
+        self.allocator.setBitrate(self.camname, self.stream.getData()["bitrate_kbs"])
+        self.checkQuota()
+        self.quotaTimer.armIn(QUOTA_CHECK)
+        self.timerStats()
+
+    def checkQuota(self): # removing files is left to the manager thread, or the allocator for the global budget
+        if self.wiper.quotaExceeded():
+            self.quotaDue = True
+            self.maintainer.post(self.maintenance)
+        self.allocator.check()
+
+    def openFiles(self):
+        return (self.stream.getData()["filename"],)
+
+    def armUpkeep(self):
+        deadline = self.stream.getDeadline()
+        if deadline:
+            self.upkeepTimer.arm(deadline)
+
+    def timerStats(self):
+        self.stats["timeline"] = self.timeline.getStats()
+        self.setStats("timerlatency", self.scheduler.getStats(self.camname))
+
+    def detectorStats(self, stats): # posted by the detector hub
+        with self.mutex:
+            self.setStats("detector", stats)
+
+    def detectorState(self, state): # posted by the detector hub
+        with self.mutex:
+            self.setValue("detectorstate", state)
+
+    def streamState(self, state): # no mutex as only called from within mutex
+        self.setValue("streamstate", state)
+
+    def setStats(self, key, value):
+        self.stats[key] = value
+        self.setValue("stats", dict(self.stats), RESTONLY)
+
+    def startStream(self):
+        result = True
+        if self.continuerec:
+            result = self.stream.start()
+        elif self.stream.prebuffer:
+            result = self.stream.startBuffer()
+            self.armUpkeep()
+        return result
 
     def requestStatus(self, interface):
         with self.mutex:
@@ -126,6 +302,8 @@ class manager(Thread):
             self.setValue("enable", self.enable, interface)
             self.setValue("record", self.record, interface)
             self.setValue("detection", "none", interface)
+            self.setValue("streamstate", repr(self.streamRetry), interface)
+            self.setValue("detectorstate", repr(self.detector.retry), interface)
 
     def getTopics(self):
         if self.topics:
@@ -147,6 +325,10 @@ class manager(Thread):
                 result = self.setEnable(value)
             elif topic == "record":
                 result = self.setRecord(value)
+            elif topic == "export":
+                result = self.setExport(value)
+            elif topic == "events":
+                result = self.requestEvents(value)
         return result
     
     def setEnable(self, enable): # enable --> self.enable
@@ -168,21 +350,46 @@ class manager(Thread):
         self.setValue("record", self.record)
         return result
 
+    def setExport(self, fmt): # json, csv or 1 for the default format, written by the manager thread
+        if str(fmt).lower() in ("0", "false"):
+            return False
+        self.exportDue = "" if str(fmt).lower() in ("1", "true") else str(fmt)
+        self.maintainer.post(self.maintenance)
+        return True
+
+    def requestEvents(self, query): # mqtt request, number of last events or json query, answered on the events status topic
+        try:
+            if isinstance(query, str):
+                query = loads(query) if query else {}
+            elif not isinstance(query, dict):
+                query = {"limit": int(query)}
+            self.setValue("events", dumps(self.queryEvents(query)), MQTTONLY, True)
+        except:
+            self.logger.error(f"Invalid events request: {query}")
+            return False
+        return True
+
+    def queryEvents(self, query): # called from the restapi and mqtt threads, the event index has its own lock
+        return self.timeline.query(query)
+
     def manageRecording(self, record): #no mutex as only called from within mutex
         if not common.getsetting(self.settings, "continuerec", False):
             if record:
                 if self.stream.recording(): # already recording, clear delayed stop
                     if self.enable:
-                        self.stream.delayedStop(0)
+                        self.stopTimer.cancel()
+                        self.logger.debug("Stop recording reset")
                 else: # start new recording
                     if self.enable:
                         self.stream.start()
             else: #(delayed) stop
                 recordpost = common.getsetting(self.settings, "recordpost", 0)
                 if recordpost > 0:
-                    self.stream.delayedStop(recordpost)
+                    if self.stream.recording():
+                        self.stopTimer.armIn(recordpost)
+                        self.logger.debug(f"Stop recording in {recordpost} s")
                 else:
-                    self.stream.stop
+                    self.stream.stop()
         return True
 
     # check code for detection parcel, doorbell - doesn't seem to work yet, keep with motion for now
@@ -191,25 +398,36 @@ class manager(Thread):
             if self.enable: # detection enabled
                 if detect: # detection started
                     self.detectionStop = 0
+                    self.detectionTimer.cancel()
                     self.manageRecording(True)
                     if self.detecting: # still detecting
                         self.setDetectionType(topicType)
                     else: # new detection
                         self.detecting = True
                         self.timeline.start(topicType, self.stream.getData())
+                        self.storage.markEvent(self.stream.getData()["filename"])
                         self.setDetected(True)
                         self.setValue("detection", topicType)
+                        self.takeSnapshot("start")
+                        snapshotpeak = common.getsetting(self.settings, "snapshotpeak", 0)
+                        if snapshotpeak > 0:
+                            self.snapshotTimer.armIn(snapshotpeak)
                 else: #detection finished
                     if self.detecting:
                         self.detectionStop = datetime.now().timestamp() + common.getsetting(self.settings, "detectpost", 5)
+                        self.detectionTimer.arm(self.detectionStop)
             elif self.detecting: # not enabled anymore but ongoing detection
-                self.detectionStop = datetime.now().timestamp() + common.getsetting(self.settings, "detectpost", 5)                
+                self.detectionStop = datetime.now().timestamp() + common.getsetting(self.settings, "detectpost", 5)
+                self.detectionTimer.arm(self.detectionStop)
         return True
 
     def manageDetectionStop(self):
         if self.detecting and self.detectionStop > 0:
-            if datetime.now().timestamp() > self.detectionStop:
+            if datetime.now().timestamp() >= self.detectionStop:
                 self.timeline.stop(self.detectionStop)
+                if self.stream.getData()["filename"] != self.timeline.getFilename(): # event continued in the next file
+                    self.storage.markEvent(self.stream.getData()["filename"])
+                self.snapshotTimer.cancel()
                 self.detectionStop = 0
                 self.detecting = False
                 self.setValue("detection", "none")
@@ -221,30 +439,64 @@ class manager(Thread):
             self.setValue("detection", topicType)
             self.timeline.updateType(topicType)
 
+    def takeSnapshot(self, kind): # no mutex as only called from within mutex, the hub downloads the snapshot
+        if self.path and common.getsetting(self.settings, "snapshot", False):
+            eventTime = self.timeline.getTime()
+            now = datetime.now().timestamp()
+            name = self.layout.filename("-" + kind + SNAPSHOTEXTENSION, now)
+            try:
+                self.layout.prepare(self.path, now)
+            except:
+                self.logger.error("Cannot create snapshot folder")
+            self.hub.snapshot(self.detector, os.path.join(self.path, name), lambda result: self.post(self.snapshotTaken, kind, name, eventTime, result))
+
+    def snapshotTaken(self, kind, name, eventTime, result): # posted by the detector hub, which never waits for the mutex
+        if result:
+            with self.mutex:
+                self.storage.closed(name)
+                self.storage.markEvent(name)
+                self.timeline.setSnapshot(kind, name, eventTime)
+            self.checkQuota()
+
+    def fileEvent(self, filename, opened): # called by the recorder, no mutex as only called from within mutex
+        if opened:
+            self.storage.opened(filename)
+            if self.detecting and not os.path.isfile(os.path.join(self.path, self.timeline.getFilename())): # started on the guessed name of a new segment
+                self.timeline.setFilename(filename)
+                self.storage.markEvent(filename)
+        else:
+            self.storage.closed(filename)
+            self.allocator.setBitrate(self.camname, self.stream.getData()["bitrate_kbs"])
+            self.checkQuota()
+
     def setDetected(self, isDetected):
         self.setValue("detected", isDetected)
 
-    def setRecording(self, isRecording):
+    def setRecording(self, isRecording): # called by the recorder on start and stop
+        if isRecording:
+            if not self.stream.segmented:
+                self.rolloverTimer.armIn(common.getsetting(self.settings, "maxfilesize", 3600) - self.stream.getData()["time_s"])
+        else:
+            self.rolloverTimer.cancel()
+            self.stopTimer.cancel()
         self.setValue("recording", isRecording)
 
-    def setValue(self, key, value, interface = 0):
+    def setValue(self, key, value, interface = 0, evt = False):
         if self.cbget:
             try:
                 alias = key
                 if self.topics:
                     alias = self.topics.getAlias(key)
-                self.cbget(self.camname, alias, value, interface)
+                self.cbget(self.camname, alias, value, interface, evt)
             except:
                 pass
 
-    def checkCleanup(self):
-        now = datetime.now().time()
-        if self.cleaned and now < CLEANUPTIME:
-            self.cleaned = False
-        elif not self.cleaned and now >= CLEANUPTIME:
-            self.wiper.cleanup()
-            self.timeline.cleanup()
-            self.cleaned = True
+    def nextCleanup(self):
+        now = datetime.now()
+        cleanup = datetime.combine(now.date(), CLEANUPTIME)
+        if self.cleaned == now.date():
+            cleanup += timedelta(days=1)
+        return cleanup.timestamp()
 
     def setPath(self):
         self.path = os.path.abspath(os.path.join(common.getsetting(self.general, "videofolder", "."),self.camname))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : scheduler.py                                #
+#           Shared timer heap for all cameras           #
+#                                                       #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+from threading import Thread, Condition
+import logging
+import heapq
+import time
+
+#########################################################
+
+####################### GLOBALS #########################
+
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : timer                                         #
+#########################################################
+class timer(object):
+    def __init__(self, scheduler, callback, owner = "", name = "", post = None):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.owner = owner
+        self.name = name
+        self.post = post # hands the callback to another thread, None runs it on the scheduler thread
+        self.when = 0 # 0 = not armed
+        self.generation = 0
+
+    def arm(self, when): # (re)arm at absolute time (timestamp), replaces a previous deadline
+        self.scheduler.add(self, when)
+
+    def armIn(self, seconds):
+        self.arm(time.time() + seconds)
+
+    def cancel(self):
+        self.scheduler.remove(self)
+
+    def armed(self):
+        return self.when > 0
+
+    def expire(self, generation, when): # called from the scheduler thread
+        if self.post:
+            self.post(self.fire, generation, when)
+        else:
+            self.fire(generation, when)
+
+    def fire(self, generation, when): # fires once, not if cancelled or re-armed after it expired
+        if generation == self.generation:
+            self.scheduler.addStats(self.owner, time.time() - when)
+            self.callback()
+
+#########################################################
+# Class : scheduler                                     #
+#########################################################
+class scheduler(Thread):
+    def __init__(self, basename):
+        self.logger = logging.getLogger('{}.scheduler'.format(basename))
+        self.condition = Condition()
+        self.heap = []
+        self.seq = 0
+        self.running = True
+        self.stats = {}
+        Thread.__init__(self)
+
+    def __del__(self):
+        del self.stats
+        del self.heap
+        del self.logger
+
+    def timer(self, callback, owner = "", name = "", post = None):
+        return timer(self, callback, owner, name, post)
+
+    def add(self, tmr, when):
+        with self.condition:
+            tmr.generation += 1
+            tmr.when = when
+            self.seq += 1
+            heapq.heappush(self.heap, (when, self.seq, tmr.generation, tmr))
+            if self.heap[0][3] is tmr: # new earliest deadline
+                self.condition.notify()
+
+    def remove(self, tmr):
+        with self.condition: # stale heap entries are skipped when popped
+            tmr.generation += 1
+            tmr.when = 0
+
+    def terminate(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def getStats(self, owner):
+        with self.condition:
+            return dict(self.stats.get(owner, {}))
+
+    def addStats(self, owner, latency): # from deadline until the callback runs, including the wait for its thread
+        with self.condition:
+            stats = self.stats.setdefault(owner, {"count": 0, "last_ms": 0, "avg_ms": 0, "max_ms": 0})
+            stats["count"] += 1
+            stats["last_ms"] = round(latency * 1000, 3)
+            stats["avg_ms"] = round(stats["avg_ms"] + (stats["last_ms"] - stats["avg_ms"]) / stats["count"], 3)
+            stats["max_ms"] = max(stats["max_ms"], stats["last_ms"])
+
+    def next(self):
+        # returns the next due timer with its generation and deadline, None if terminated
+        with self.condition:
+            while self.running:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                when, _, generation, tmr = self.heap[0]
+                if generation != tmr.generation: # cancelled or re-armed
+                    heapq.heappop(self.heap)
+                    continue
+                now = time.time()
+                if when > now:
+                    self.condition.wait(when - now)
+                    continue
+                heapq.heappop(self.heap)
+                tmr.when = 0
+                return tmr, generation, when
+        return None
+
+    def run(self):
+        self.logger.info("running")
+        while due := self.next():
+            tmr, generation, when = due
+            try:
+                tmr.expire(generation, when)
+            except Exception as e:
+                self.logger.exception(e)
+        self.logger.info("terminating")
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
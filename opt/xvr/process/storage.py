@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : storage.py                                  #
+#           index of recorded files for cleanup         #
+#           without directory scans                     #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import logging
+import os
+import sqlite3
+from threading import Lock
+from datetime import datetime
+from common.layout import EXTENSIONS
+
+#########################################################
+
+####################### GLOBALS #########################
+INDEXFILE  = ".index.db"
+MEMORYFILE = ":memory:" # fallback if the index cannot be stored, rebuilt on every start anyway
+PENDING    = 3600 # s, time to wait for a file indexed before it was written
+VERSION    = 2 # index layout, an index with another layout is recreated
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : storage                                       #
+#########################################################
+class storage(object):
+    def __init__(self, basename, camname, path, layout, cbEvents = None): # cbEvents returns files with events from the timeline
+        self.logger = logging.getLogger('{}.storage [{}]'.format(basename, camname))
+        self.camname = camname
+        self.path = path
+        self.layout = layout
+        self.cbEvents = cbEvents
+        self.mutex = Lock()
+        self.db = None
+        self.total = 0
+        self.mismatch = True # rebuild on startup
+        if self.path:
+            try:
+                self.db = self.connect(os.path.join(self.path, INDEXFILE))
+            except:
+                self.logger.error("Cannot open storage index, keeping it in memory")
+                self.db = self.connect(MEMORYFILE)
+
+    def __del__(self):
+        self.close()
+        del self.mutex
+        del self.logger
+
+    def connect(self, filename):
+        db = sqlite3.connect(filename, check_same_thread = False, isolation_level = None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if db.execute("PRAGMA user_version").fetchone()[0] != VERSION: # rebuilt on startup anyway
+            db.execute("DROP TABLE IF EXISTS files")
+            db.execute(f"PRAGMA user_version={VERSION}")
+        db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, events INTEGER NOT NULL DEFAULT 0)")
+        db.execute("CREATE INDEX IF NOT EXISTS files_evict ON files (events > 0, mtime)")
+        return db
+
+    def close(self):
+        with self.mutex:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+    def opened(self, name): # file opened by the recorder, size follows on close
+        self.update(name, 0, datetime.now().timestamp())
+
+    def closed(self, name):
+        self.stat(name)
+
+    def stat(self, name): # add or update a file from disk
+        try:
+            st = os.stat(os.path.join(self.path, name))
+            self.update(name, st.st_size, st.st_mtime)
+        except FileNotFoundError: # not written yet, updated on cleanup
+            self.update(name, 0, datetime.now().timestamp())
+        except:
+            self.logger.error(f"Cannot index {name}")
+
+    def update(self, name, size, mtime):
+        if not name or not os.path.splitext(name)[1] in EXTENSIONS:
+            return
+        with self.mutex:
+            if self.db:
+                try:
+                    row = self.db.execute("SELECT size FROM files WHERE name = ?", (name,)).fetchone()
+                    self.db.execute("INSERT INTO files (name, mtime, size) VALUES (?, ?, ?) ON CONFLICT (name) DO UPDATE SET mtime = excluded.mtime, size = excluded.size", (name, mtime, size))
+                    self.total += size - (row[0] if row else 0)
+                except:
+                    self.logger.error(f"Cannot update storage index for {name}")
+
+    def markEvent(self, name): # file contains (part of) a detection, kept for keepeventdays
+        if not name or not os.path.splitext(name)[1] in EXTENSIONS:
+            return
+        with self.mutex:
+            if self.db:
+                try:
+                    self.db.execute("INSERT INTO files (name, mtime, size, events) VALUES (?, ?, 0, 1) ON CONFLICT (name) DO UPDATE SET events = events + 1", (name, datetime.now().timestamp()))
+                except:
+                    self.logger.error(f"Cannot mark event in storage index for {name}")
+
+    def remove(self, name): # delete a file and its entry, returns the freed size
+        size = 0
+        with self.mutex:
+            if self.db:
+                row = self.db.execute("SELECT size FROM files WHERE name = ?", (name,)).fetchone()
+                if row:
+                    size = row[0]
+                    self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+                    self.total -= size
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            self.logger.debug(f"{name} was already removed, rebuild storage index")
+            self.mismatch = True
+        self.layout.prune(self.path, os.path.dirname(name))
+        return size
+
+    def removeFolder(self, folder): # remove a whole partition, returns the freed size
+        prefix = folder + os.sep
+        size = 0
+        with self.mutex:
+            if self.db:
+                size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM files WHERE name LIKE ?", (prefix + "%",)).fetchone()[0]
+                self.db.execute("DELETE FROM files WHERE name LIKE ?", (prefix + "%",))
+                self.total -= size
+        self.layout.removeFolder(self.path, folder)
+        return size
+
+    def oldest(self, before = None, idle = False, events = False): # files to remove first, files without events before files with events, oldest first
+        query = "SELECT name, size FROM files"
+        conditions = []
+        params = []
+        if before != None:
+            conditions.append("mtime < ?")
+            params.append(before)
+        if idle:
+            conditions.append("events = 0")
+        elif events:
+            conditions.append("events > 0")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY events > 0, mtime LIMIT 100"
+        with self.mutex:
+            if not self.db:
+                return []
+            return self.db.execute(query, params).fetchall()
+
+    def first(self, keep = ()): # next file to remove as (has events, mtime, name), to compare files of several cameras, None if none
+        with self.mutex:
+            if not self.db:
+                return None
+            rows = self.db.execute("SELECT events > 0, mtime, name FROM files ORDER BY events > 0, mtime LIMIT 100").fetchall()
+        return next((row for row in rows if row[2] not in keep), None)
+
+    def refresh(self): # files indexed without size (still open or written later)
+        with self.mutex:
+            rows = self.db.execute("SELECT name, mtime FROM files WHERE size = 0").fetchall() if self.db else []
+        now = datetime.now().timestamp()
+        for name, mtime in rows:
+            if os.path.isfile(os.path.join(self.path, name)):
+                self.stat(name)
+            elif now - mtime > PENDING:
+                with self.mutex:
+                    self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def check(self): # rebuild from disk on startup or when the index doesn't match the disk
+        if self.mismatch and self.db:
+            self.mismatch = False
+            self.rebuild()
+        else:
+            self.refresh()
+
+    def scan(self, folder, events, files): # camera folder and partitions, hidden folders (spool) are skipped
+        with os.scandir(os.path.join(self.path, folder)) as entries:
+            for entry in entries:
+                name = os.path.join(folder, entry.name)
+                if entry.is_dir(follow_symlinks = False):
+                    if not entry.name.startswith("."):
+                        self.scan(name, events, files)
+                elif entry.is_file() and os.path.splitext(entry.name)[1] in EXTENSIONS:
+                    st = entry.stat()
+                    files[name] = (name, st.st_mtime, st.st_size, events.get(name, 0))
+
+    def rebuild(self):
+        self.logger.debug("Rebuilding storage index")
+        try:
+            files = {}
+            events = self.cbEvents() if self.cbEvents else {}
+            self.scan("", events, files)
+            with self.mutex:
+                self.db.execute("BEGIN")
+                try:
+                    self.db.execute("DELETE FROM files")
+                    self.db.executemany("INSERT INTO files (name, mtime, size, events) VALUES (?, ?, ?, ?)", files.values())
+                    self.db.execute("COMMIT")
+                except:
+                    self.db.execute("ROLLBACK")
+                    raise
+                self.total = sum(f[2] for f in files.values())
+            self.logger.debug(f"Storage index contains {len(files)} files, {self.total / (1024*1024):.0f} MB")
+        except:
+            self.logger.error("Cannot rebuild storage index")
+            self.mismatch = True
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
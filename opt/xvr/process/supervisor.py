@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : supervisor.py                               #
+#           Waits on all ffmpeg children and dispatches #
+#           their events to the owning camera           #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+from threading import Thread, Lock
+import logging
+import os
+import selectors
+
+#########################################################
+
+####################### GLOBALS #########################
+
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : supervisor                                    #
+#########################################################
+class supervisor(Thread):
+    def __init__(self, basename):
+        self.logger = logging.getLogger('{}.supervisor'.format(basename))
+        self.selector = selectors.DefaultSelector()
+        self.mutex = Lock()
+        self.pending = []
+        self.deferred = {} # fd: callback, paused until the event is handled on another thread
+        self.current = None # key of the fd whose callback is running
+        self.running = True
+        self.wakeRead, self.wakeWrite = os.pipe()
+        os.set_blocking(self.wakeRead, False)
+        os.set_blocking(self.wakeWrite, False)
+        self.selector.register(self.wakeRead, selectors.EVENT_READ, None)
+        Thread.__init__(self)
+
+    def __del__(self):
+        del self.deferred
+        del self.pending
+        del self.mutex
+        del self.logger
+
+    def register(self, fd, callback):
+        # callback is called from the supervisor thread when fd is readable (or closed)
+        self.queue(("register", fd, callback))
+
+    def unregister(self, fd):
+        self.queue(("unregister", fd, None))
+
+    def watch(self, process, callback):
+        # callback is called once when the child process exits, returns the pidfd or None
+        pidfd = None
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError): # no pidfd support, exit is seen as EOF on stderr
+            pass
+        if pidfd != None:
+            self.register(pidfd, callback)
+        return pidfd
+
+    def close(self, fd):
+        # unregister and close an fd owned by the supervisor (pidfd, progress pipe)
+        if fd != None:
+            self.queue(("close", fd, None))
+
+    def defer(self):
+        # called from a callback that hands the event to another thread, the fd is not selected
+        # until the returned resume function is called, so a readable fd doesn't wake the loop again
+        key = self.current
+        self.selector.unregister(key.fd)
+        self.deferred[key.fd] = key.data
+        return lambda: self.queue(("resume", key.fd, key.data))
+
+    def queue(self, op):
+        with self.mutex:
+            self.pending.append(op)
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self.wakeWrite, b"\0")
+        except BlockingIOError: # already woken
+            pass
+
+    def terminate(self):
+        self.running = False
+        self.wake()
+
+    def handlePending(self):
+        with self.mutex:
+            pending = self.pending
+            self.pending = []
+        for op, fd, callback in pending:
+            try:
+                if op == "register":
+                    self.selector.register(fd, selectors.EVENT_READ, callback)
+                elif op == "resume": # only if not unregistered or closed (and maybe reused) in the meantime
+                    if self.deferred.get(fd) is callback:
+                        del self.deferred[fd]
+                        self.selector.register(fd, selectors.EVENT_READ, callback)
+                else:
+                    self.deferred.pop(fd, None)
+                    if fd in self.selector.get_map():
+                        self.selector.unregister(fd)
+                    if op == "close":
+                        os.close(fd)
+            except (KeyError, ValueError, OSError) as e:
+                self.logger.debug(f"Cannot {op} fd {fd}: {e}")
+
+    def run(self):
+        self.logger.info("running")
+        while self.running:
+            for key, _ in self.selector.select():
+                if key.data == None:
+                    try:
+                        while os.read(self.wakeRead, 64):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.fd in self.selector.get_map():
+                    self.current = key
+                    try:
+                        key.data()
+                    except Exception as e:
+                        self.logger.exception(e)
+                    self.current = None
+            self.handlePending()
+        self.logger.info("terminating")
+        self.selector.close()
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
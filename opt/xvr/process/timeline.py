@@ -9,16 +9,25 @@
 ####################### IMPORTS #########################
 import logging
 import os
+import shutil
+from threading import Lock
 from datetime import datetime, timedelta
 from common.common import common
+from process.eventindex import eventindex, DEFAULT_LIMIT
 import json
 
 #########################################################
 
 ####################### GLOBALS #########################
 TIMELINE_FILE = "timeline"
-TIMELINE_EXTJSON = ".json"
-TIMELINE_EXTCSV = ".csv"
+TIMELINE_EXTJSONL = ".jsonl"
+TIMELINE_EXTJSON = ".json" # export
+TIMELINE_EXTCSV = ".csv" # export
+TIMELINE_EXTTMP = ".tmp" # rewritten timeline, replaces the timeline when complete
+FIELDS = ("time", "type", "filename", "filetime", "duration", "snapshot", "snapshotpeak")
+TIMEFORMAT = "%Y-%m-%d %H:%M:%S"
+TIMEPREFIX = b'{"time": "' # entries are written with the time first
+TIMELENGTH = 19 # length of a formatted time
 #########################################################
 
 ###################### FUNCTIONS ########################
@@ -29,15 +38,22 @@ TIMELINE_EXTCSV = ".csv"
 # Class : timeline                                      #
 #########################################################
 class timeline(object):
-    def __init__(self, basename, camname, settings, general, path):
+    def __init__(self, basename, camname, settings, general, path, writer = None): # writer appends entries in the background
         self.logger = logging.getLogger('{}.timeline [{}]'.format(basename, camname))
         self.camname = camname
         self.settings = settings
         self.general = general
         self.path = path
-        self.data = {"time": 0, "type": "none", "filename": "", "filetime": 0, "duration": 0}
+        self.data = {"time": 0, "type": "none", "filename": "", "filetime": 0, "duration": 0, "snapshot": "", "snapshotpeak": ""}
+        self.writer = writer
+        self.mutex = Lock() # appending and rewriting the timeline
+        self.index = eventindex(basename, camname, path)
+        if self.path:
+            self.index.sync(self.GetFilename())
 
     def __del__(self):
+        del self.index
+        del self.mutex
         del self.data
         del self.logger
 
@@ -47,6 +63,8 @@ class timeline(object):
         self.data["filename"] = streamData["filename"]
         self.data["filetime"] = streamData["time_s"]
         self.data["duration"] = 0
+        self.data["snapshot"] = ""
+        self.data["snapshotpeak"] = ""
 
     def stop(self, stopTime):
         self.data["duration"] = stopTime - self.data["time"]
@@ -55,128 +73,220 @@ class timeline(object):
     def updateType(self, topicType):
         self.data["type"] = topicType
 
-    def cleanup(self):
-        days = common.getsetting(self.settings, "keepdays", 28)
-        if days > 0:
+    def getTime(self):
+        return self.data["time"]
+
+    def getFilename(self):
+        return self.data["filename"]
+
+    def setFilename(self, filename):
+        self.data["filename"] = filename
+
+    def setSnapshot(self, kind, name, eventTime): # ignored if the event is already written
+        if self.data["time"] == eventTime and not self.data["duration"]:
+            self.data["snapshot" if kind == "start" else "snapshotpeak"] = name
+
+    def getEventFiles(self): # number of events per recorded file, to build the storage index
+        events = {}
+        try:
+            for jline in self.readEntries():
+                for key in ("filename", "snapshot", "snapshotpeak"):
+                    name = jline.get(key)
+                    if name:
+                        events[name] = events.get(name, 0) + 1
+        except:
+            self.logger.error("Cannot read events from timeline")
+        return events
+
+    def renameFiles(self, moved): # update filenames after the recordings are moved to another folder layout
+        filename = self.GetFilename()
+        if moved and filename:
+            def rename(f):
+                for jline in self.readEntries():
+                    for key in ("filename", "snapshot", "snapshotpeak"):
+                        if jline.get(key) in moved:
+                            jline[key] = moved[jline[key]]
+                    f.write(json.dumps(jline) + "\n")
+            with self.mutex:
+                self.index.reset()
+                self.replaceFile(filename, rename)
+                self.index.sync(filename)
+
+    def cleanup(self): # entries are kept as long as the files with events
+        days = common.getsetting(self.settings, "keepeventdays", common.getsetting(self.settings, "keepdays", 28))
+        filename = self.GetFilename()
+        if days > 0 and filename:
             self.logger.debug("Cleaning up timeline")
-            if common.getsetting(self.general, "timelineformat", "json").lower() == "json":
-                self.cleanupJson(days)
-            else:
-                self.cleanupCsv(days)
-
-    def addData(self):
-        data = self.processData()  
-        if common.getsetting(self.general, "timelineformat", "json").lower() == "json":
-            self.writeJson(data)
+            cutoff = (datetime.now() - timedelta(days = days + 1)).strftime(TIMEFORMAT).encode()
+            try:
+                with open(filename, "rb") as f:
+                    position = 0
+                    deleted = 0
+                    for line in f: # entries are appended in time order, so only a head of old entries is removed
+                        time = self.lineTime(line)
+                        if time != None and time > cutoff:
+                            break
+                        position += len(line)
+                        deleted += 1
+                    if deleted:
+                        def keep(dest):
+                            f.seek(position)
+                            shutil.copyfileobj(f, dest)
+                        with self.mutex: # no entries appended while copying
+                            self.index.sync(filename) # the removed part must be indexed to drop it
+                            self.replaceFile(filename, keep, "wb")
+                            if not self.index.drop(position):
+                                self.index.reset()
+                        self.logger.debug(f"Cleanup timeline: deleted {deleted} entries")
+            except:
+                self.logger.error("Cannot cleanup timeline")
+            self.index.sync(filename)
+
+    def lineTime(self, line): # time of an entry as bytes, compared as text as it has a fixed format, None if invalid
+        if line.startswith(TIMEPREFIX) and line[len(TIMEPREFIX) + TIMELENGTH:len(TIMEPREFIX) + TIMELENGTH + 1] == b'"':
+            return line[len(TIMEPREFIX):len(TIMEPREFIX) + TIMELENGTH]
+        try:
+            return json.loads(line)["time"].encode()
+        except:
+            return None
+
+    def replaceFile(self, filename, write, mode = "w"): # write a new file next to the old one and replace it when complete
+        tmpname = filename + TIMELINE_EXTTMP
+        try:
+            with open(tmpname, mode) as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpname, filename)
+        except:
+            if os.path.isfile(tmpname):
+                os.remove(tmpname)
+            raise
+
+    def addData(self): # queued for the writer, so a slow disk doesn't hold up detections
+        line = json.dumps(self.processData()) + "\n"
+        if self.writer:
+            self.writer.put(self, line)
         else:
-            self.writeCsv(data)
-        self.logger.debug("Added timeline data")
+            self.append([line])
+
+    def append(self, lines, fsync = False): # append only, the file is never read back when adding
+        filename = self.GetFilename()
+        if not filename:
+            return False
+        with self.mutex:
+            try:
+                with open(filename, "a") as f:
+                    f.write("".join(lines))
+                    if fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                self.logger.debug(f"Added {len(lines)} timeline entries")
+            except:
+                self.logger.error("Cannot write timeline")
+                return False
+            self.index.sync(filename) # only reads the appended lines
+        return True
+
+    def getStats(self):
+        if self.writer:
+            return self.writer.getStats(self.camname)
+        return {}
 
     def processData(self):
         data = {}
-        data["time"] = datetime.fromtimestamp(self.data["time"]).strftime("%Y-%m-%d %H:%M:%S")
+        data["time"] = datetime.fromtimestamp(self.data["time"]).strftime(TIMEFORMAT)
         data["type"] = self.data["type"]
         data["filename"] = self.data["filename"]
         data["filetime"] = str(timedelta(seconds=int(self.data["filetime"]))) #).strftime("%H:%M:%S")
         data["duration"] = int(self.data["duration"])
+        data["snapshot"] = self.data["snapshot"]
+        data["snapshotpeak"] = self.data["snapshotpeak"]
         return data
-    
-    def writeJson(self, data):
-        filename = self.GetFilename()
-        if filename:
-            jdata = json.dumps(data) + "\n" + "]\n"
-            with open(filename, "r+") as f:
-                pos = 0
-                while line := f.readline().strip():
-                    if line[0] != "]":
-                        pos = f.tell()
-                f.seek(pos)
-                f.truncate()
-                if pos > 2:
-                    f.write(",\n")
-                f.write(jdata)
-
-    def writeCsv(self, data):
-        filename = self.GetFilename()
-        if filename:
-            cdata = "{}, {}, {}, {}, {}\n".format(data["time"], data["type"], data["filename"], data["filetime"], data["duration"])
-            with open(filename, "a") as f:
-                f.write(cdata)
 
-    def cleanupJson(self, days):
-        filename = self.GetFilename()
-        if filename:
-            with open(filename, "r+") as f:
-                lines = f.readlines()
-                f.seek(0)
-                dellist = []
-                for i, line in enumerate(lines):
-                    try:
-                        if line[0] == "{":
-                            jline = json.loads(line)
-                            if self.deleteLine(jline["time"], days):
-                                dellist.append(i)
-                                self.logger.debug(f"Cleanup timeline: deleted {jline["time"]}")
-                                if i + 1 < len(lines):
-                                        if lines[i+1][0] == ",":
-                                            dellist.append(i+1)
-                    except:
-                        pass
-                if dellist:
-                    for i in reversed(dellist):
-                        lines.pop(i)
-                    f.truncate()
-                    f.writelines(lines)
-
-    def cleanupCsv(self, days):
+    def readEntries(self): # yields the entries of the timeline
         filename = self.GetFilename()
         if filename:
-            with open(filename, "r+") as f:
-                lines = f.readlines()
-                f.seek(0)
-                dellist = []
-                for i, line in enumerate(lines):
+            with open(filename, "r") as f:
+                for line in f:
                     try:
-                        timeStr = line.split(",")[0].strip()
-                        if timeStr != "time":
-                            if self.deleteLine(timeStr, days):
-                                dellist.append(i)
-                                self.logger.debug(f"Cleanup timeline: deleted {timeStr}")
-                    except:
-                        pass
-                if dellist:
-                    for i in reversed(dellist):
-                        lines.pop(i)
-                    f.truncate()
-                    f.writelines(lines)
-
-    def deleteLine(self, timeStr, days):
-        result = False
+                        yield json.loads(line)
+                    except ValueError:
+                        pass # partly written line
+
+    def query(self, query): # {"from": time, "to": time, "type": "person,vehicle", "offset": 0, "limit": 100}, newest first
+        types = query.get("type")
+        if isinstance(types, str):
+            types = [t.strip() for t in types.split(",") if t.strip()]
+        return self.index.query(eventindex.parseTime(query.get("from")), eventindex.parseTime(query.get("to")), types,
+                                query.get("offset", 0), query.get("limit", DEFAULT_LIMIT))
+
+    def export(self, fmt = None): # write the timeline as json array or csv file, as before the append only timeline
+        if not fmt:
+            fmt = common.getsetting(self.general, "timelineformat", "json")
+        fmt = str(fmt).lower()
+        if not self.path or fmt not in (TIMELINE_EXTJSON[1:], TIMELINE_EXTCSV[1:]):
+            return ""
+        filename = os.path.join(self.path, TIMELINE_FILE + "." + fmt)
         try:
-            timeFmt = datetime.strptime(timeStr, "%Y-%m-%d %H:%M:%S")
-            if (datetime.now() - timeFmt).days > days:
-                result = True
+            self.replaceFile(filename, self.exportJson if fmt == TIMELINE_EXTJSON[1:] else self.exportCsv)
+            self.logger.info(f"Exported timeline to {filename}")
         except:
-            pass
-        return result
+            self.logger.error(f"Cannot export timeline to {filename}")
+            filename = ""
+        return filename
+
+    def exportJson(self, f):
+        f.write("[\n")
+        first = True
+        for jline in self.readEntries():
+            if not first:
+                f.write(",\n")
+            f.write(json.dumps(jline) + "\n")
+            first = False
+        f.write("]\n")
+
+    def exportCsv(self, f):
+        f.write(", ".join(FIELDS) + "\n")
+        for jline in self.readEntries():
+            f.write(", ".join(str(jline.get(field, "")) for field in FIELDS) + "\n")
+
+    def importData(self, filename): # entries of a json array or csv timeline
+        entries = []
+        csv = filename.endswith(TIMELINE_EXTCSV)
+        with open(filename, "r") as f:
+            for line in f:
+                try:
+                    if not csv:
+                        if line.startswith("{"): # one entry per line, between [ and , lines
+                            entries.append(json.loads(line))
+                    elif not line.startswith("time,") and line.strip():
+                        vals = [val.strip() for val in line.split(",")]
+                        jline = dict(zip(FIELDS, vals))
+                        jline["duration"] = int(jline.get("duration", 0))
+                        entries.append(jline)
+                except:
+                    pass
+        return entries
 
     def GetFilename(self):
         filename = ""
         if not self.path:
             self.logger.error("Cannot record timeline, as no path available")
         else:
-            if common.getsetting(self.general, "timelineformat", "json").lower() == "json":
-                filename = os.path.join(self.path, TIMELINE_FILE + TIMELINE_EXTJSON)
-                if not os.path.isfile(filename):
-                    with open(filename, "w") as f:
-                        f.write("[\n]\n")
-                    self.logger.info(f"Created new timeline file {filename}")
-            else:
-                filename = os.path.join(self.path, TIMELINE_FILE + TIMELINE_EXTCSV)
-                if not os.path.isfile(filename):
-                    with open(filename, "w") as f:
-                        f.write("time, type, filename, filetime, duration\n")
-                    self.logger.info(f"Created new timeline file {filename}")
+            filename = os.path.join(self.path, TIMELINE_FILE + TIMELINE_EXTJSONL)
+            if not os.path.isfile(filename):
+                entries = []
+                for ext in (TIMELINE_EXTJSON, TIMELINE_EXTCSV): # convert the timeline of a previous version
+                    oldname = os.path.join(self.path, TIMELINE_FILE + ext)
+                    if os.path.isfile(oldname) and not entries:
+                        try:
+                            entries = self.importData(oldname)
+                        except:
+                            self.logger.error(f"Cannot convert timeline file {oldname}")
+                with open(filename, "w") as f:
+                    f.writelines(json.dumps(jline) + "\n" for jline in entries)
+                self.logger.info(f"Created new timeline file {filename}")
         return filename
 
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : timelinewriter.py                           #
+#           Writes timeline entries of all cameras in   #
+#           the background, grouped per flush           #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+from threading import Thread, Event, Lock
+from queue import Queue, Empty, Full
+import logging
+import time
+from common.common import common
+
+#########################################################
+
+####################### GLOBALS #########################
+QUEUE_SIZE = 1024 # entries waiting to be written, further entries are dropped
+POLL       = 1 # s, check for termination while idle
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : timelinewriter                                #
+#########################################################
+class timelinewriter(Thread):
+    def __init__(self, basename, general):
+        self.logger = logging.getLogger('{}.timelinewriter'.format(basename))
+        self.fsync = common.getsetting(general, "timelinefsync", False)
+        self.queue = Queue(common.getsetting(general, "timelinequeue", QUEUE_SIZE))
+        self.mutex = Lock()
+        self.stats = {}
+        self.term = Event()
+        self.term.clear()
+        Thread.__init__(self)
+
+    def __del__(self):
+        del self.stats
+        del self.queue
+        del self.term
+        del self.mutex
+        del self.logger
+
+    def put(self, timeline, line): # never blocks the caller, the entry is dropped if the queue is full
+        try:
+            self.queue.put_nowait((timeline, line))
+            return True
+        except Full:
+            with self.mutex:
+                stats = self.cameraStats(timeline.camname)
+                stats["dropped"] += 1
+            self.logger.error(f"Timeline queue full, entry of {timeline.camname} dropped")
+            return False
+
+    def getStats(self, owner):
+        with self.mutex:
+            stats = dict(self.stats.get(owner, {}))
+        stats["queued"] = self.queue.qsize()
+        return stats
+
+    def cameraStats(self, owner): # no mutex as only called from within mutex
+        return self.stats.setdefault(owner, {"written": 0, "dropped": 0, "flushes": 0, "batch": 0, "last_ms": 0, "avg_ms": 0, "max_ms": 0})
+
+    def addStats(self, owner, count, latency):
+        with self.mutex:
+            stats = self.cameraStats(owner)
+            stats["written"] += count
+            stats["flushes"] += 1
+            stats["batch"] = count
+            stats["last_ms"] = round(latency * 1000, 3)
+            stats["avg_ms"] = round(stats["avg_ms"] + (stats["last_ms"] - stats["avg_ms"]) / stats["flushes"], 3)
+            stats["max_ms"] = max(stats["max_ms"], stats["last_ms"])
+
+    def collect(self): # everything queued at this moment, grouped per timeline in order of arrival
+        batch = {}
+        try:
+            item = self.queue.get(timeout = POLL)
+            while item:
+                batch.setdefault(item[0], []).append(item[1])
+                item = self.queue.get_nowait()
+        except Empty:
+            pass
+        return batch
+
+    def flush(self, batch): # one write (and fsync) per timeline for all of its entries
+        for timeline, lines in batch.items():
+            start = time.monotonic()
+            if timeline.append(lines, self.fsync):
+                self.addStats(timeline.camname, len(lines), time.monotonic() - start)
+
+    def run(self):
+        self.logger.info("running")
+        while not self.term.is_set():
+            self.flush(self.collect())
+        batch = self.collect() # entries of the last detections
+        while batch:
+            self.flush(batch)
+            batch = self.collect() if not self.queue.empty() else {}
+        self.logger.info("terminating")
+
+    def terminate(self):
+        self.term.set()
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
@@ -23,13 +23,17 @@
 #########################################################
 class topicData:
     name = "xvr"
-    pub = ["enable", "record"]
-    sub = ["recording", "detected", "enable", "record", "detection"]
-    topics = [{"cmd_t": "enable", "stat_t": "enable",    "type": "switch",        "dev_cla": ""},
-              {"cmd_t": "record", "stat_t": "record",    "type": "switch",        "dev_cla": ""},
-              {"cmd_t": "",       "stat_t": "recording", "type": "binary_sensor", "dev_cla": "running"},
-              {"cmd_t": "",       "stat_t": "detected",  "type": "binary_sensor", "dev_cla": "motion"},
-              {"cmd_t": "",       "stat_t": "detection", "type": "sensor",        "dev_cla": ""}]
+    pub = ["enable", "record", "export", "events"]
+    sub = ["recording", "detected", "enable", "record", "detection", "streamstate", "detectorstate", "stats", "events"]
+    topics = [{"cmd_t": "enable", "stat_t": "enable",        "type": "switch",        "dev_cla": ""},
+              {"cmd_t": "record", "stat_t": "record",        "type": "switch",        "dev_cla": ""},
+              {"cmd_t": "export", "stat_t": "",              "type": "button",        "dev_cla": ""},
+              {"cmd_t": "events", "stat_t": "events",        "type": "",              "dev_cla": ""},
+              {"cmd_t": "",       "stat_t": "recording",     "type": "binary_sensor", "dev_cla": "running"},
+              {"cmd_t": "",       "stat_t": "detected",      "type": "binary_sensor", "dev_cla": "motion"},
+              {"cmd_t": "",       "stat_t": "detection",     "type": "sensor",        "dev_cla": ""},
+              {"cmd_t": "",       "stat_t": "streamstate",   "type": "sensor",        "dev_cla": ""},
+              {"cmd_t": "",       "stat_t": "detectorstate", "type": "sensor",        "dev_cla": ""}]
     
 ######################### MAIN ##########################
 if __name__ == "__main__":
@@ -8,15 +8,14 @@
 
 ####################### IMPORTS #########################
 import logging
-import os 
-from datetime import datetime
+from datetime import datetime, timedelta
 from common.common import common
 
 #########################################################
 
 ####################### GLOBALS #########################
-VIDEOEXTENSION = ".mp4"
-MB2B           = 1024*1024
+MB2B            = 1024*1024
+QUOTA_LOW       = 90 # %, low watermark, files are removed until below this part of maxsizemb
 #########################################################
 
 ###################### FUNCTIONS ########################
@@ -27,75 +26,81 @@ MB2B           = 1024*1024
 # Class : wiper                                         #
 #########################################################
 class wiper(object):
-    def __init__(self, basename, camname, settings, path):
+    def __init__(self, basename, camname, settings, path, storage, layout):
         self.logger = logging.getLogger('{}.wiper [{}]'.format(basename, camname))
         self.camname = camname
         self.settings = settings
         self.path = path
+        self.storage = storage
+        self.layout = layout
 
     def __del__(self):
         del self.logger
 
-    def cleanup(self):
+    def cleanup(self, keep = ()): # daily, on age and quota
         if not self.path:
             self.logger.error("Cannot cleanup, as no path available")
         else:
+            self.storage.check()
             days = common.getsetting(self.settings, "keepdays", 28)
+            eventdays = common.getsetting(self.settings, "keepeventdays", days)
+            if days > 0 and eventdays > 0 and self.layout.partitioned():
+                self.wipeFolders(max(days, eventdays))
             if days > 0:
-                self.logger.debug("Cleaning up files on max time")
-                self.wipeFilesTime(days)
-            mbs = common.getsetting(self.settings, "maxsizemb", 0)
-            if mbs > 0:
-                self.logger.debug("Cleaning up files on max folder size")
-                self.wipeFilesSize(days)
+                self.logger.debug("Cleaning up files without events on max time")
+                self.wipeFilesTime(days, True)
+            if eventdays > 0:
+                self.logger.debug("Cleaning up files with events on max time")
+                self.wipeFilesTime(eventdays, events = True)
+            self.enforce(keep)
 
-    def wipeFilesTime(self, days):
-        try:
-            list_of_files = os.listdir(self.path) 
-            current_time = datetime.now()
+    def quotaExceeded(self): # cheap check when a file is closed, the high watermark is maxsizemb
+        if not self.path:
+            return False
+        mbs = common.getsetting(self.settings, "maxsizemb", 0)
+        return mbs > 0 and self.storage.total > mbs * MB2B
 
-            for file in list_of_files: 
-                file_location = os.path.join(self.path, file)
-                ext = os.path.splitext(file_location)[1]
-                if ext == VIDEOEXTENSION:
-                    file_time = datetime.fromtimestamp(os.stat(file_location).st_mtime)
-                    if (current_time - file_time).days > days:
-                        os.remove(file_location)
-                        self.logger.debug(f"Cleanup video files: deleted {file_location}")
+    def enforce(self, keep = ()): # delete oldest files, without events first, until under the low watermark (free disk space is left to the allocator)
+        mbs = common.getsetting(self.settings, "maxsizemb", 0)
+        if not self.path or mbs <= 0:
+            return
+        lowmark = mbs * MB2B * common.getsetting(self.settings, "quotalow", QUOTA_LOW) / 100
+        if self.storage.total > lowmark:
+            self.logger.debug("Cleaning up files on max folder size")
+        try:
+            while self.storage.total > lowmark:
+                removed = False
+                for name, size in self.storage.oldest():
+                    if name in keep:
+                        continue
+                    self.storage.remove(name)
+                    removed = True
+                    self.logger.debug(f"Cleanup video files: deleted {name}")
+                    if self.storage.total <= lowmark:
+                        break
+                if not removed:
+                    break
         except:
-            self.logger.error("Cannot remove files on max time")
+            self.logger.error("Cannot remove files on max folder size")
 
-    def wipeFilesSize(self, fsize):
+    def wipeFolders(self, days): # drop whole expired partitions
         try:
-            list_of_files = os.listdir(self.path) 
-            maxsize = fsize * MB2B
-            files = []
-            totalsize = 0
-            for file in list_of_files:
-                file_location = os.path.join(self.path, file) 
-                ext = os.path.splitext(file_location)[1]
-                if ext == VIDEOEXTENSION:
-                    fdata = {}
-                    fdata["fname"] = file_location
-                    fdata["time"] = os.stat(file_location).st_mtime
-                    fdata["size"] = os.stat(file_location).st_size
-                    totalsize += fdata["size"]
-                    files.append(fdata)
-            if totalsize > maxsize:
-                files.sort(key = self.sortfunc)
-                dellist = []
-                for i, file in enumerate(files):
-                    if totalsize > maxsize:
-                        totalsize -= file["size"]
-                        dellist.append(i)
-                for i in dellist:
-                    os.remove(files[i]["fname"])
-                    self.logger.debug("Cleanup video files: deleted {}".format(files[i]["fname"]))
+            before = (datetime.now() - timedelta(days=days + 1)).timestamp()
+            for folder in self.layout.expired(self.path, before):
+                self.storage.removeFolder(folder)
+                self.logger.debug(f"Cleanup video files: deleted folder {folder}")
         except:
-            self.logger.error("Cannot remove files on max folder size")
+            self.logger.error("Cannot remove folders on max time")
 
-    def sortfunc(self, e):
-        return e['time']
+    def wipeFilesTime(self, days, idle = False, events = False): # files older than days, only without or with events, oldest first from the storage index
+        try:
+            before = (datetime.now() - timedelta(days=days + 1)).timestamp()
+            while files := self.storage.oldest(before, idle, events):
+                for name, size in files:
+                    self.storage.remove(name)
+                    self.logger.debug(f"Cleanup video files: deleted {name}")
+        except:
+            self.logger.error("Cannot remove files on max time")
 
 ######################### MAIN ##########################
 if __name__ == "__main__":
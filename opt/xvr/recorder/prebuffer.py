@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : prebuffer.py                                #
+#           Keeps a rolling buffer of stream segments   #
+#           to add pre-event footage to recordings      #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import ffmpeg
+import os
+import logging
+from datetime import datetime
+from common.common import common
+#########################################################
+
+####################### GLOBALS #########################
+SEGMENTTIME      = 2 # s, length of a single spooled segment
+SEGMENTEXTENSION = ".ts"
+SEGMENTFORMAT    = "%Y%m%d-%H%M%S"
+CONCATLIST       = "concat.txt"
+SHMFOLDER        = "/dev/shm"
+SPOOLFOLDER      = "xvr"
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : prebuffer                                     #
+#########################################################
+class prebuffer(object):
+    def __init__(self, basename, camname, settings, general, recpath, supervisor = None, cbEvent = None, cbFile = None):
+        self.logger = logging.getLogger('{}.prebuffer [{}]'.format(basename, camname))
+        self.camname = camname
+        self.settings = settings
+        self.pre = common.getsetting(settings, "recordpre", 0)
+        self.path = self.setPath(general, recpath)
+        self.supervisor = supervisor
+        self.cbEvent = cbEvent
+        self.cbFile = cbFile
+        self.process = None
+        self.pidfd = None
+        self.segments = [] # [(starttime, filename)] sorted on starttime
+        self.jobs = []     # recordings holding segments, oldest first
+        self.concat = None # running concat job
+
+    def __del__(self):
+        del self.jobs
+        del self.segments
+        del self.logger
+
+    def start(self, stream, codecs, globalargs):
+        if self.process:
+            return True
+        if not self.path:
+            self.logger.error("Cannot start prebuffer, as no spool path available")
+            return False
+        if self.jobs or self.concat: # restarted, segments are still needed by recordings, prune removes them when done
+            self.update()
+        else:
+            self.clearSpool()
+        try:
+            self.process = (
+                ffmpeg
+                    .input(stream)
+                    .output(os.path.join(self.path, SEGMENTFORMAT + SEGMENTEXTENSION),
+                            f="segment", segment_time=SEGMENTTIME, segment_format="mpegts",
+                            reset_timestamps=1, strftime=1, **codecs)
+                    .global_args(*globalargs)
+                    .overwrite_output()
+                    .run_async(pipe_stderr=True)
+                )
+        except Exception as e:
+            self.logger.error("Error starting prebuffer stream")
+            self.logger.error(e)
+            self.process = None
+        if self.process:
+            os.set_blocking(self.process.stderr.fileno(), False)
+            if self.supervisor and self.cbEvent:
+                self.supervisor.register(self.process.stderr.fileno(), self.cbEvent)
+                self.pidfd = self.supervisor.watch(self.process, self.cbEvent)
+            self.logger.debug(f"Prebuffer started, keeping {self.pre} s")
+        return (self.process != None)
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(timeout=5)
+            self.releaseProcess()
+            self.process = None
+            self.logger.debug("Prebuffer stopped")
+        now = datetime.now().timestamp()
+        for job in self.jobs:
+            if not job["to"]:
+                job["to"] = now
+        self.update()
+        while self.jobs:
+            self.finalize()
+            if self.concat:
+                self.concat["process"].wait(timeout=30)
+                self.concatDone()
+
+    def running(self):
+        return self.process != None
+
+    def interval(self):
+        return SEGMENTTIME
+
+    def releaseProcess(self):
+        if self.supervisor and self.cbEvent:
+            self.supervisor.unregister(self.process.stderr.fileno())
+            self.supervisor.close(self.pidfd)
+            self.pidfd = None
+
+    def poll(self):
+        poll = None
+        if self.process:
+            poll = self.process.poll()
+            try:
+                while buf := os.read(self.process.stderr.fileno(), 4096):
+                    buf = buf.decode("utf-8", "replace").replace("\r","").strip()
+                    if buf:
+                        self.logger.error(buf)
+                if poll == None: # EOF, process is exiting
+                    poll = self.process.wait(timeout=5)
+            except BlockingIOError:
+                pass
+            except:
+                pass
+            if poll != None:
+                self.releaseProcess()
+                self.process = None
+        self.update()
+        if self.concat and self.concat["process"].poll() != None:
+            self.concatDone()
+        if not self.concat:
+            self.finalize()
+        self.prune()
+        return poll
+
+    def hold(self, fromtime, outputname, title, after = False):
+        # after: continue a previous recording, only take segments starting after fromtime
+        start = fromtime
+        if not after:
+            for segtime, _ in self.segments:
+                if segtime <= fromtime:
+                    start = segtime
+                else:
+                    break
+            if self.segments and self.segments[0][0] > start:
+                start = self.segments[0][0]
+        job = {"start": start, "after": after, "to": 0, "output": outputname, "title": title}
+        self.jobs.append(job)
+        return job
+
+    def release(self, job, totime):
+        job["to"] = totime
+
+    def update(self):
+        try:
+            names = sorted(f for f in os.listdir(self.path) if f.endswith(SEGMENTEXTENSION))
+        except:
+            names = []
+        segments = []
+        for name in names:
+            try:
+                segtime = datetime.strptime(name[:-len(SEGMENTEXTENSION)], SEGMENTFORMAT).timestamp()
+                segments.append((segtime, name))
+            except:
+                pass
+        self.segments = segments
+
+    def jobSegments(self, job):
+        if job["after"]:
+            return [name for segtime, name in self.segments if job["start"] < segtime <= job["to"]]
+        return [name for segtime, name in self.segments if job["start"] <= segtime <= job["to"]]
+
+    def finalize(self):
+        # finalize the oldest job once the segment covering its stop time is complete
+        if self.jobs and self.jobs[0]["to"] and not self.concat:
+            job = self.jobs[0]
+            complete = not self.process or (self.segments and self.segments[-1][0] > job["to"])
+            if complete:
+                segments = self.jobSegments(job)
+                if not segments:
+                    self.logger.error("No buffered segments available for {}".format(job["output"]))
+                    self.jobs.pop(0)
+                    return
+                listname = os.path.join(self.path, CONCATLIST)
+                try:
+                    with open(listname, "w") as f:
+                        for name in segments:
+                            f.write("file '{}'\n".format(os.path.join(self.path, name)))
+                    process = (
+                        ffmpeg
+                            .input(listname, f="concat", safe=0)
+                            .output(job["output"], c="copy", metadata="title=" + job["title"])
+                            .global_args("-nostats", "-hide_banner", "-loglevel", "error")
+                            .overwrite_output()
+                            .run_async(pipe_stderr=True)
+                        )
+                    self.concat = {"process": process, "job": job, "list": listname, "pidfd": None}
+                    if self.supervisor and self.cbEvent:
+                        self.concat["pidfd"] = self.supervisor.watch(process, self.cbEvent)
+                    self.logger.debug("Writing {} from {} buffered segments".format(job["output"], len(segments)))
+                except Exception as e:
+                    self.logger.error("Error writing buffered recording")
+                    self.logger.error(e)
+                    self.jobs.pop(0)
+
+    def concatDone(self):
+        process = self.concat["process"]
+        if process.returncode:
+            try:
+                self.logger.error(process.stderr.read().decode("utf-8").strip())
+            except:
+                pass
+            self.logger.error("Error writing buffered recording {}".format(self.concat["job"]["output"]))
+        if self.cbFile and os.path.isfile(self.concat["job"]["output"]): # the recording is only closed once it is written
+            self.cbFile(self.concat["job"]["output"])
+        if self.supervisor:
+            self.supervisor.close(self.concat["pidfd"])
+        try:
+            os.remove(self.concat["list"])
+        except:
+            pass
+        if self.concat["job"] in self.jobs:
+            self.jobs.remove(self.concat["job"])
+        self.concat = None
+
+    def prune(self):
+        keep = datetime.now().timestamp() - self.pre
+        for job in self.jobs:
+            keep = min(keep, job["start"])
+        # a segment can be removed when the next segment started before keep
+        for i in range(len(self.segments) - 1):
+            if self.segments[i + 1][0] > keep:
+                break
+            try:
+                os.remove(os.path.join(self.path, self.segments[i][1]))
+            except:
+                pass
+
+    def clearSpool(self):
+        try:
+            for name in os.listdir(self.path):
+                if name.endswith(SEGMENTEXTENSION) or name == CONCATLIST:
+                    os.remove(os.path.join(self.path, name))
+        except:
+            self.logger.error("Cannot clear spool folder")
+        self.segments = []
+
+    def setPath(self, general, recpath):
+        spool = common.getsetting(general, "spoolfolder")
+        if not spool:
+            if os.access(SHMFOLDER, os.W_OK):
+                spool = os.path.join(SHMFOLDER, SPOOLFOLDER)
+            elif recpath:
+                return self.makePath(os.path.join(recpath, "." + SPOOLFOLDER))
+            else:
+                return None
+        return self.makePath(os.path.join(spool, self.camname))
+
+    def makePath(self, path):
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except:
+                self.logger.error(f"Cannot create spool folder {path}")
+                path = None
+        return path
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : progress.py                                 #
+#           Parses ffmpeg -progress key=value output    #
+#                                                       #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+
+#########################################################
+
+####################### GLOBALS #########################
+INTKEYS   = ("frame", "out_time_us", "total_size", "drop_frames", "dup_frames")
+FLOATKEYS = {"bitrate": "kbits/s", "speed": "x"}
+#########################################################
+
+###################### FUNCTIONS ########################
+
+#########################################################
+
+#########################################################
+# Class : progress                                      #
+#########################################################
+class progress(object):
+    def __init__(self):
+        self.buffer = b""
+        self.block = {}
+        self.clear()
+
+    def __del__(self):
+        del self.block
+        del self.data
+
+    def clear(self):
+        self.buffer = b""
+        self.block = {}
+        self.data = {
+            "frame": 0,
+            "out_time_us": 0,
+            "total_size": 0,
+            "bitrate": 0.0,
+            "speed": 0.0,
+            "drop_frames": 0,
+            "dup_frames": 0,
+            "end": False
+        }
+
+    def feed(self, buf): # returns True if a complete progress block was received
+        updated = False
+        self.buffer += buf
+        lines = self.buffer.split(b"\n")
+        self.buffer = lines.pop() # keep partial line for next feed
+        for line in lines:
+            key, sep, value = line.decode("utf-8", "replace").strip().partition("=")
+            if not sep:
+                continue
+            if key == "progress": # last key of a block
+                self.update(self.block)
+                self.data["end"] = value == "end"
+                self.block = {}
+                updated = True
+            else:
+                self.block[key] = value.strip()
+        return updated
+
+    def update(self, block):
+        for key in INTKEYS:
+            if key in block:
+                try:
+                    self.data[key] = int(block[key])
+                except ValueError: # N/A
+                    pass
+        for key, unit in FLOATKEYS.items():
+            if key in block:
+                try:
+                    self.data[key] = float(block[key].removesuffix(unit))
+                except ValueError: # N/A
+                    pass
+
+    def getData(self):
+        return self.data
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    pass
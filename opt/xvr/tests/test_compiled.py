@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : test_compiled.py                            #
+#           compiled onvif requests, called like the    #
+#           subscription managers do                    #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import os
+import sys
+import asyncio
+import unittest
+import httpx
+from zeep.transports import AsyncTransport
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from onvif.client import ONVIFService
+from onvif.exceptions import ONVIFError
+#########################################################
+
+####################### GLOBALS #########################
+WSDL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "onvif", "wsdl", "events.wsdl")
+BINDING = "{http://www.onvif.org/ver10/events/wsdl}SubscriptionManagerBinding"
+XADDR = "http://camera/onvif/subscription"
+RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsnt="http://docs.oasis-open.org/wsn/b-2">
+<s:Body><wsnt:RenewResponse>
+<wsnt:TerminationTime>2024-12-09T15:54:15Z</wsnt:TerminationTime>
+<wsnt:CurrentTime>2024-12-09T15:53:15Z</wsnt:CurrentTime>
+</wsnt:RenewResponse></s:Body></s:Envelope>"""
+#########################################################
+
+#########################################################
+# Class : testCompiled                                  #
+#########################################################
+class testCompiled(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.requests = []
+        self.service = ONVIFService(XADDR, "user", "pass", WSDL, no_cache = True, binding_name = BINDING)
+        self.service.transport = AsyncTransport(client = httpx.AsyncClient(transport = httpx.MockTransport(self.handler)), wsdl_client = httpx.Client())
+        self.loop.run_until_complete(self.service.setup())
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.service.transport.aclose())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def handler(self, request):
+        self.requests.append(request.content.decode("utf-8"))
+        return httpx.Response(200, content = RESPONSE, headers = {"Content-Type": "application/soap+xml"})
+
+    def renew(self, params):
+        return self.loop.run_until_complete(self.service.Renew(params))
+
+    def testRenewRelative(self): # managers pass the termination time as positional string
+        result = self.renew("PT60S")
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn(">PT60S</", self.requests[0])
+        self.assertEqual(result.TerminationTime.year, 2024)
+
+    def testRenewAbsolute(self): # absolute times fill the hole of one compiled request
+        self.renew("2024-12-09T15:54:15Z")
+        self.renew({"TerminationTime": "2024-12-09T15:55:15Z"})
+        self.assertIn(">2024-12-09T15:54:15Z</", self.requests[0])
+        self.assertIn(">2024-12-09T15:55:15Z</", self.requests[1])
+        self.assertEqual(len(self.service._compiled._requests), 1)
+
+    def testRenewError(self): # errors rendering the request are onvif errors
+        with self.assertRaises(ONVIFError):
+            self.renew({"Unknown": "PT60S"})
+        self.assertEqual(self.requests, [])
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : test_scheduler.py                           #
+#           timers handed to another thread fire once,  #
+#           and not after being cancelled               #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import os
+import sys
+import time
+import unittest
+from collections import deque
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from process.scheduler import scheduler
+#########################################################
+
+####################### GLOBALS #########################
+WAIT = 2 # s, maximum wait for a timer to expire
+#########################################################
+
+#########################################################
+# Class : testScheduler                                 #
+#########################################################
+class testScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tasks = deque() # like the manager queue, run on the test thread
+        self.fired = []
+        self.scheduler = scheduler("test")
+        self.scheduler.start()
+        self.timer = self.scheduler.timer(lambda: self.fired.append(time.time()), "cam", "test", self.post)
+
+    def tearDown(self):
+        self.scheduler.terminate()
+        self.scheduler.join(5)
+
+    def post(self, task, *args):
+        self.tasks.append((task, args))
+
+    def expire(self): # wait until the timer is queued
+        self.timer.armIn(0.01)
+        end = time.time() + WAIT
+        while not self.tasks and time.time() < end:
+            time.sleep(0.01)
+        self.assertEqual(len(self.tasks), 1)
+
+    def runTasks(self):
+        while self.tasks:
+            task, args = self.tasks.popleft()
+            task(*args)
+
+    def testFire(self):
+        self.expire()
+        self.runTasks()
+        self.assertEqual(len(self.fired), 1)
+        self.assertEqual(self.scheduler.getStats("cam")["count"], 1)
+
+    def testCancelQueued(self): # cancelled after expiry, but before the callback ran
+        self.expire()
+        self.timer.cancel()
+        self.runTasks()
+        self.assertEqual(self.fired, [])
+
+    def testRearmQueued(self): # re-armed after expiry, only the new deadline fires
+        self.expire()
+        self.timer.armIn(60)
+        self.runTasks()
+        self.assertEqual(self.fired, [])
+        self.assertTrue(self.timer.armed())
+
+    def testLatency(self): # includes the time the callback waited in the queue
+        self.expire()
+        time.sleep(0.1)
+        self.runTasks()
+        self.assertGreaterEqual(self.scheduler.getStats("cam")["last_ms"], 100)
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    unittest.main()
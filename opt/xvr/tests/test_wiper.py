@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : test_wiper.py                               #
+#           cleanup on keepdays and keepeventdays       #
+#                                                       #
+#           I. Helwegen 2024                            #
+#########################################################
+
+####################### IMPORTS #########################
+import os
+import sys
+import time
+import tempfile
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.layout import layout
+from process.storage import storage
+from process.wiper import wiper
+#########################################################
+
+####################### GLOBALS #########################
+DAY = 86400
+#########################################################
+
+#########################################################
+# Class : testWiper                                     #
+#########################################################
+class testWiper(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        self.layout = layout({})
+        self.storage = storage("test", "cam", self.path, self.layout, lambda: {"event.mp4": 1})
+        for name in ("idle.mp4", "event.mp4"):
+            filename = os.path.join(self.path, name)
+            with open(filename, "wb") as f:
+                f.write(b"0" * 1024)
+            old = time.time() - 120 * DAY
+            os.utime(filename, (old, old))
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def cleanup(self, settings):
+        wiper("test", "cam", settings, self.path, self.storage, self.layout).cleanup()
+        return sorted(os.listdir(self.path))
+
+    def files(self, names):
+        return sorted(names + [name for name in os.listdir(self.path) if name.startswith(".")])
+
+    def testKeepAlwaysIdle(self): # keepdays 0 keeps files without events, however old
+        self.assertEqual(self.cleanup({"keepdays": 0, "keepeventdays": 90}), self.files(["idle.mp4"]))
+
+    def testKeepIdleLonger(self): # keepdays longer than keepeventdays
+        self.assertEqual(self.cleanup({"keepdays": 200, "keepeventdays": 90}), self.files(["idle.mp4"]))
+
+    def testKeepEventsLonger(self):
+        self.assertEqual(self.cleanup({"keepdays": 90, "keepeventdays": 200}), self.files(["event.mp4"]))
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    unittest.main()